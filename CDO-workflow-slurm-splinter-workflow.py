@@ -23,6 +23,7 @@ import concurrent.futures
 
 splinter = importlib.import_module("splinter")
 importlib.reload(splinter)
+import splinter_history
 
 import timeit
 import yaml as yaml
@@ -227,6 +228,19 @@ def node_cores(job):
         return int(float(job.metadata['maestro_cores']))
     return None
 
+# files/CDOs a job reads (option '-i') or writes (option '-o') with their sizes,
+# taken from the job uses and from File objects in its argument list
+def job_data_sizes(job, option):
+    uses = job.get_inputs() if option=='-i' else job.get_outputs()
+    data = {f.lfn: node_memory(f) or 0 for f in uses}
+    in_option = False
+    for a in job.args:
+        if isinstance(a, str) and a.startswith('-'):
+            in_option = (a==option)
+        elif in_option and isinstance(a, File):
+            data[a.lfn] = node_memory(a) or 0
+    return data
+
 
 # In[30]:
 
@@ -532,8 +546,14 @@ class Maestro_Workflow(Workflow):
             
         # build parent/child dependency lists 
         self.build_dependencies()
-        # create a splinter workflow
-        swf = splinter.splinter_workflow()
+        # create a splinter workflow, completed tasks are added to the history
+        # which also provides duration/memory estimates from earlier runs :
+        # once measured 3 times, a task reserves the p95 of its peak memory
+        # plus 10% instead of the maestro_mem guess. Tasks in srun steps are
+        # not sampled locally, their peak memory comes from sacct
+        history = splinter_history.task_history(os.path.join(SCRATCH_PATH, 'splinter-history.sqlite'))
+        swf = splinter.splinter_workflow(history=history, memory_percentile=95, memory_headroom=0.1,
+                                         sacct_memory=srun)
         
         for id, job in self.jobs.items():
             t_string = "None::" + job.transformation + "::None"
@@ -552,11 +572,16 @@ class Maestro_Workflow(Workflow):
                 print('Invalid memory', job, job.args)
             if cores is None:
                 print('Invalid cores', job, job.args)
-            splinter_task = splinter.task(id, command, parents, cores, memory)
+            splinter_task = splinter.task(id, command, parents, cores, memory, name=job.transformation,
+                                          inputs=job_data_sizes(job, '-i'), outputs=job_data_sizes(job, '-o'))
             swf.add_task(splinter_task)
             
         # poll freq, use srun
-        swf.execute_workflow(0.1, srun)
+        try:
+            swf.execute_workflow(0.1, srun)
+        finally:
+            history.close()
+        return swf
 
 
 # In[32]:
@@ -871,11 +896,15 @@ try:
                         print("Error, wrong cdo/beegfs/lustre param")
                         
                     start = time.time()
-                    wff.execute_using_splinter(srun)
+                    swf = wff.execute_using_splinter(srun)
                     end = time.time()
                     elapsed = end-start
                                             
                     print(f'CSVData, Args_size, {size}, iterations, {iterations}, forks, {forks}, IO, {cdo}, Elapsed, {elapsed}')
+                    # per task timings of this sweep point, csv for maestro_plotutils, json for perfetto
+                    trace_name = f'splinter-trace-{cdo}-{forks}-{iterations}-{size}'
+                    swf.trace().write_csv(trace_name + '.csv', {'IO': cdo, 'Args_size': size, 'iterations': iterations, 'forks': forks})
+                    swf.trace().write_chrome(trace_name + '.json')
                     # stime = time.strftime("%Y-%m-%d.%H:%M:%S", time.gmtime())
                     # os.rename('commands.txt', 'commands-' + stime + '.txt')
 
@@ -11,6 +11,8 @@ from optparse import OptionParser
 
 from Pegasus import yaml
 
+import splinter_history
+
 COLORS = [
     "#1b9e77",
     "#d95f02",
@@ -83,6 +85,7 @@ class Job(Node):
     def __init__(self):
         Node.__init__(self)
         self.xform       = None
+        self.arguments   = []
         self.cdo_watcher = False
         self.cdo_cache   = False
         self.cdo_pm      = False;
@@ -108,6 +111,13 @@ class Job(Node):
         else:
             label = self.label
 
+        # overlay the duration predicted from the splinter task history
+        if renderer.history is not None:
+            predicted = renderer.history.predict_duration(
+                self.xform, splinter_history.argument_data_size(self.arguments))
+            if predicted is not None:
+                label = "{}\\n~{:.1f}s".format(label, predicted)
+
         # watcher node
         if self.cdo_watcher:
             renderer.renderNode(self.id, "watcher\n" + self.label, fillcolor="#efefff", shape="plaintext")
@@ -180,6 +190,7 @@ def parse_yamlfile(fname, include_files):
             j.xform = job["file"]
 
         j.id = j.label = job["id"]
+        j.arguments = job.get("arguments", [])
         dag.nodes[j.id] = j
 
         if job.get("nodeLabel"):
@@ -369,12 +380,16 @@ class emit_dot:
         outfile: The file name to write the diagam out to.
         width: The width of the diagram
         height: The height of the diagram
+        history: A splinter_history.task_history, when given jobs are
+                 labelled with their predicted (median) duration
     """
 
     def __init__(
-        self, dag, label_type="label", outfile="/dev/stdout", width=None, height=None, leftright=False
+        self, dag, label_type="label", outfile="/dev/stdout", width=None, height=None, leftright=False,
+        history=None
     ):
         self.label_type = label_type
+        self.history = history
 
         self.next_color = 0  # Keep track of next color
         self.colors = {}  # Keep track of transformation names to assign colors
@@ -495,6 +510,15 @@ DAGMan file, Pegasus YAML file, or Pegasus DAX file."""
         default=False,
         help="Include files. This option is only valid for YAML and DAX files. [default: false]",
     )
+    parser.add_option(
+        "-t",
+        "--history",
+        action="store",
+        dest="history",
+        metavar="FILE",
+        default=None,
+        help="Label jobs with their predicted duration from a splinter task history FILE",
+    )
 
     (options, args) = parser.parse_args()
 
@@ -525,7 +549,11 @@ DAGMan file, Pegasus YAML file, or Pegasus DAX file."""
     if options.simplify:
         dag = transitivereduction(dag)
 
-    emit_dot(dag, options.label, options.outfile, options.width, options.height)
+    history = None
+    if options.history:
+        history = splinter_history.task_history(options.history)
+
+    emit_dot(dag, options.label, options.outfile, options.width, options.height, history=history)
 
 
 if __name__ == "__main__":
@@ -3,9 +3,23 @@
 import subprocess
 import time
 import concurrent.futures
-import humanfriendly
+import bisect
+import heapq
+import itertools
 import hostlist
 import os
+import sys
+import shutil
+import tempfile
+import threading
+import contextlib
+import queue
+import splinter_launch
+import splinter_history
+import splinter_journal
+import splinter_trace
+import splinter_metrics
+import splinter_topology
 
 # -------------------------------------------------------------------
 # reminder for when we set flags during debugging that need to be switched off on real runs
@@ -33,8 +47,7 @@ def execute_local_shell(script):
 # -------------------------------------------------------------------
 # execute srun command locally to launch job on node remotely
 def execute_srun(executor, job_id, host, command):
-    commands = f'srun --jobid={job_id} -w {host} -u -N 1 -n 1 -c 1 --mem-per-cpu=0 --overcommit --overlap'
-    commands = commands.split(' ') + command
+    commands = splinter_launch.srun_command(job_id, host, command)
     cstr1 = ' '.join(commands)
     print('SLURM executing', cstr1)
     future = executor.submit(subprocess.run, commands, stdout=subprocess.PIPE)
@@ -69,67 +82,154 @@ def get_slurm_job():
     return job_id
 
 # -------------------------------------------------------------------
+# lstopo the topology probe should use on a node, None to let the probe
+# find one on the PATH (or fall back to sysfs when there is none)
 def get_lstopo(node):
-    # default lstopo location
-    lstopo = '/usr/bin/lstopo-no-graphics'
-
     # override if env var set
     if os.getenv('LSTOPO') is not None:
         lstopo = os.getenv('LSTOPO')
         print('lstopo is', lstopo)
-    else:
-        if 'oryx' in node:
-            lstopo = 'LSTOPO=/home/biddisco/opt/spack.git/var/spack/environments/dev/.spack-env/view/bin/lstopo-no-graphics'
-        elif 'daint' in node or 'nid' in node:
-            lstopo = 'LSTOPO=/apps/daint/UES/jenkins/7.0.UP02-20.11/mc/easybuild/software/hwloc/2.4.1/bin/lstopo-no-graphics'
-        print('Please set env var LSTOPO : using :', lstopo)
-    return lstopo
+        return lstopo
+    # known locations on our machines, ignored by the probe if not present
+    if 'oryx' in node:
+        return '/home/biddisco/opt/spack.git/var/spack/environments/dev/.spack-env/view/bin/lstopo-no-graphics'
+    elif 'daint' in node or 'nid' in node:
+        return '/apps/daint/UES/jenkins/7.0.UP02-20.11/mc/easybuild/software/hwloc/2.4.1/bin/lstopo-no-graphics'
+    return None
 
 # -------------------------------------------------------------------
-# get number of sockets, numa domains, cores, pus, memory for a node
-# we should get hwloc paths from the remote environment, or radle, but for now - use hardcoded
-def get_node_compute_data(node):
-    # default lstopo location
-    lstopo = get_lstopo(node)
+# run the topology probe (splinter_topology.py) on a node, its source is
+# piped into python3 over ssh so nothing needs to be installed on the node
+def execute_ssh_probe(host, lstopo, pool):
+    with open(splinter_topology.__file__) as f:
+        source = f.read()
+    command = 'python3 -'
+    if lstopo is not None:
+        command = 'LSTOPO=' + lstopo + ' ' + command
+    process = subprocess.run(pool.command(host, command), input=source,
+                             stdout=subprocess.PIPE, encoding='utf-8')
+    return process.stdout
 
-    command = 'LSTOPO=' + lstopo + '''
-    sockets=$( $LSTOPO | grep Package | wc -l )
-    numanodes=$( $LSTOPO | grep NUMANode | wc -l )
-    cores=$( $LSTOPO | grep Core | wc -l )
-    pus=$( $LSTOPO | grep ' PU' | wc -l )
-    memory=$( $LSTOPO -v | grep Machine | grep -oE "total=([0-9]+.B)" )
-    echo "$( hostname ):$sockets:$numanodes:$cores:$pus:$memory"'''
+# -------------------------------------------------------------------
+# get a node record (see splinter_topology.probe_node) for a node : sockets,
+# numa domains, cores, pus, memory and the full core/PU/cache layout,
+# the probe runs once on the node and reads one lstopo xml or sysfs
+def get_node_compute_data(node, pool):
+    lstopo = get_lstopo(node)
     if node!='localhost':
-        info = execute_ssh_shell(node, command)
+        info = execute_ssh_probe(node, lstopo, pool)
     else:
-        info = execute_local_shell(command)
+        env = dict(os.environ)
+        if lstopo is not None:
+            env['LSTOPO'] = lstopo
+        info = subprocess.run([sys.executable, splinter_topology.__file__], env=env,
+                              stdout=subprocess.PIPE, encoding='utf-8').stdout
 
-    print('Node data', info)
-    # get the last non empty string
-    last = next(s for s in reversed(info.split('\n')) if s)
-    data = last.split(':')
-    data[5] = humanfriendly.parse_size(str(data[5]).replace('total=',''))
+    record = splinter_topology.parse_probe_output(info)
+    if record is None:
+        raise RuntimeError('no topology returned by ' + node + ' : ' + info)
+    print('Node data', node, record['source'], record['fingerprint'])
     # warning('WARNING - Reducing core count by 4 per node')
-    # data[3] = data[3] - 4 
-    return data
+    # record['cores'] = record['cores'] - 4
+    return record
 
 # -------------------------------------------------------------------
-# get node information for a list of nodes, by ssh-ing into each
-def get_all_node_data(node_list):
+# get node information for a list of nodes, by ssh-ing into each, at most
+# max_sessions at a time and over multiplexed (ControlMaster) connections
+def get_ssh_node_data(node_list, max_sessions=32):
     node_info = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(node_list)) as executor:
-        future_to_data = {executor.submit(get_node_compute_data, n): n for n in node_list}
-        for future in concurrent.futures.as_completed(future_to_data):
-            node = future_to_data[future]
-            try:
-                data = future.result()
-                print('Node data is', data)
-            except Exception as exc:
-                print('%r generated an exception: %s' % (node, exc))
-            else:
-                if node!=data[0]:
-                    print('Warning, node returned unexpected hostname', node, '!=', data[0])
-                node_info[node] = data[1:]
+    pool = splinter_launch.ssh_pool()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(node_list), max_sessions)) as executor:
+            future_to_data = {executor.submit(get_node_compute_data, n, pool): n for n in node_list}
+            for future in concurrent.futures.as_completed(future_to_data):
+                node = future_to_data[future]
+                try:
+                    record = future.result()
+                except Exception as exc:
+                    print('%r generated an exception: %s' % (node, exc))
+                else:
+                    if node!=record['hostname'] and node!='localhost':
+                        print('Warning, node returned unexpected hostname', node, '!=', record['hostname'])
+                    node_info[node] = record
+    finally:
+        pool.close()
+    return node_info
+
+# -------------------------------------------------------------------
+# get node information for all the nodes of the allocation with a single
+# srun step running the probe once per node, the records of every node
+# come back together in the output of the step
+def get_srun_node_data(node_list, job_id, timeout=120):
+    env = dict(os.environ)
+    lstopo = get_lstopo(node_list[0])
+    if lstopo is not None:
+        env['LSTOPO'] = lstopo
+    commands = ['srun', f'--jobid={job_id}', '-w', hostlist.collect_hostlist(node_list),
+                '-N', str(len(node_list)), '--ntasks-per-node=1', '-c', '1', '--mem-per-cpu=0',
+                '--overlap', '--kill-on-bad-exit=0', 'python3', splinter_topology.__file__]
+    print('SLURM executing', ' '.join(commands))
+    try:
+        output = subprocess.run(commands, env=env, stdout=subprocess.PIPE, encoding='utf-8',
+                                timeout=timeout).stdout
+    except subprocess.TimeoutExpired as exc:
+        print('srun discovery timed out after', timeout, 's')
+        output = exc.stdout.decode('utf-8') if isinstance(exc.stdout, bytes) else (exc.stdout or '')
+    except OSError as exc:
+        print('srun discovery failed :', exc)
+        return {}
+    records = splinter_topology.parse_probe_records(output)
+    # the hostname a node reports may be qualified where the node list is not
+    short_names = {hostname.split('.')[0]: record for hostname, record in records.items()}
+    node_info = {}
+    for node in node_list:
+        record = records.get(node, short_names.get(node.split('.')[0]))
+        if record is not None:
+            node_info[node] = record
+    return node_info
+
+# -------------------------------------------------------------------
+# ways of probing the nodes of an allocation, srun is used by default
+# inside a SLURM job, ssh otherwise and for any node srun did not report
+discovery_methods = ('srun', 'ssh')
+
+# -------------------------------------------------------------------
+# get node information for a list of nodes
+def get_all_node_data(node_list, job_id=0, discovery=None):
+    if discovery is None:
+        discovery = 'srun' if job_id!=0 and shutil.which('srun') is not None else 'ssh'
+    if discovery not in discovery_methods:
+        raise ValueError('Unknown discovery method ' + str(discovery))
+    node_info = {}
+    if discovery=='srun':
+        node_info = get_srun_node_data(node_list, job_id)
+    missing = [node for node in node_list if node not in node_info]
+    if len(missing)!=0:
+        if discovery=='srun':
+            print('srun discovery did not report', hostlist.collect_hostlist(missing), ', using ssh')
+        node_info.update(get_ssh_node_data(missing))
+    return node_info
+
+# -------------------------------------------------------------------
+# get node information for a list of nodes, from the on disk topology cache
+# where possible, only nodes that are not cached (or whose entry expired,
+# or all of them when refresh is set) are probed
+def get_cached_node_data(node_list, refresh=False, ttl=None, job_id=0, discovery=None):
+    cache = splinter_topology.topology_cache(ttl=ttl)
+    node_info = {}
+    if not refresh:
+        for node in node_list:
+            data = cache.get(node)
+            if data is not None:
+                node_info[node] = data
+    missing = [node for node in node_list if node not in node_info]
+    print('Topology cache', cache.path(), ':', len(node_info), 'cached,', len(missing), 'to probe')
+    if len(missing)!=0:
+        probed = get_all_node_data(missing, job_id, discovery)
+        for node, data in probed.items():
+            cache.put(node, data)
+        cache.save()
+        node_info.update(probed)
     return node_info
 
 # -------------------------------------------------------------------
@@ -140,11 +240,25 @@ class task:
     _cores   = 1
     _memory  = 1024*1024
     _node    = None
+    _cost    = None
+    _name    = None
+    _inputs  = {}
+    _outputs = {}
+    _cpu_units = None
+    _cpus    = None
+    _peak_memory = None
     _dependent_task_array = []
     _provider_task_array = []
 
-    def __init__(self, task_id, command, dependent_task_array, cores, memory):
+    # name is the transformation the task runs (defaults to the executable name)
+    # inputs/outputs are dicts of file or CDO name to size in bytes, they are
+    # used to place consumers on the node where their data was produced
+    def __init__(self, task_id, command, dependent_task_array, cores, memory, name=None,
+                 inputs=None, outputs=None):
         self._task_id = task_id
+        self._name    = name
+        self._inputs  = inputs if inputs is not None else {}
+        self._outputs = outputs if outputs is not None else {}
         self._command = command
         self._cores   = cores
         self._memory  = memory
@@ -161,12 +275,43 @@ class task:
     def task_id(self):
         return self._task_id
 
+    def inputs(self):
+        return self._inputs
+
+    def outputs(self):
+        return self._outputs
+
+    def name(self):
+        if self._name is not None:
+            return self._name
+        return os.path.basename(str(self._command[0]))
+
     def cores(self):
         return self._cores
 
     def memory(self):
         return self._memory
 
+    # the memory reserved for the task, replaced by an estimate from the
+    # history before it runs (see splinter_workflow.estimate_task_memory)
+    def set_memory(self, memory):
+        self._memory = memory
+
+    # peak memory (bytes) the task used when it ran, None if not measured
+    def set_peak_memory(self, peak_memory):
+        self._peak_memory = peak_memory
+
+    def peak_memory(self):
+        return self._peak_memory
+
+    # estimated cost (e.g. seconds) of the task, used for prioritisation
+    # None when nothing is known about it
+    def set_cost(self, cost):
+        self._cost = cost
+
+    def cost(self):
+        return self._cost
+
     # when running, the node being used is stored in the task
     def set_node(self, node):
         self._node = node
@@ -174,16 +319,71 @@ class task:
     def node(self):
         return self._node
 
+    # when running with cpu binding, the units (cores or PUs) allocated to the
+    # task on its node and the OS cpu indices they cover
+    def set_cpus(self, cpu_units, cpus):
+        self._cpu_units = cpu_units
+        self._cpus      = cpus
+
+    def cpu_units(self):
+        return self._cpu_units
+
+    def cpus(self):
+        return self._cpus
+
 # -------------------------------------------------------------------
 # represents an 'in flight' graph node executing that will complete and set
 # a result in a future
 class task_status:
     _task = None
     _future = None
+    _start_time = 0
+    _logs = None
 
-    def __init__(self, task, future):
+    # logs is the (stdout, stderr) pair of files the task writes to, or None
+    # start_time is the launch time on the scheduler's clock, default now
+    def __init__(self, task, future, logs=None, start_time=None):
         self._future = future
         self._task = task
+        self._logs = logs
+        self._start_time = start_time if start_time is not None else time.time()
+
+    # time the task was launched
+    def start_time(self):
+        return self._start_time
+
+    # exit code and start/end time of a finished task, the times measured
+    # where the task ran are used when the launcher reports them,
+    # a task whose launch raised an exception has exit code -1
+    def outcome(self):
+        exit_code = -1
+        start_time, end_time = self._start_time, time.time()
+        if self._future.exception() is None:
+            result = self._future.result()
+            exit_code = result.returncode
+            if getattr(result, 'start_time', None) is not None:
+                start_time, end_time = result.start_time, result.end_time
+        return exit_code, start_time, end_time
+
+    # time from the launch until the task started, None when the launcher
+    # did not report when it started
+    def launch_latency(self):
+        if self._future.exception() is not None:
+            return None
+        start_time = getattr(self._future.result(), 'start_time', None)
+        return start_time - self._start_time if start_time is not None else None
+
+    # peak memory of the task and free memory of its node when it ended
+    # (bytes), when the launcher measured them
+    def peak_memory(self):
+        if self._future.exception() is not None:
+            return None
+        return getattr(self._future.result(), 'peak_memory', None)
+
+    def mem_available(self):
+        if self._future.exception() is not None:
+            return None
+        return getattr(self._future.result(), 'mem_available', None)
 
     def future(self):
         return self._future
@@ -191,202 +391,1527 @@ class task_status:
     def task(self):
         return self._task
 
+    def logs(self):
+        return self._logs
+
 def mem_gb(memory):
     return int(memory/(1024*1024*1024))
 
+# -------------------------------------------------------------------
+# default cost of a task, when no estimate is set every task counts as 1
+# so the critical path is simply the longest chain of tasks
+def default_task_cost(task):
+    return task.cost() if task.cost() is not None else 1.0
+
+# -------------------------------------------------------------------
+# ready task priority policies. Before execution prepare() is given the tasks
+# and the child adjacency lists, ready tasks are then dispatched in increasing
+# order of priority(task), ties are dispatched in the order they became ready.
+# Tasks submitted during execution are given to add(task), if the policy has it
+# fifo : dispatch in the order tasks become ready
+class fifo_priority:
+
+    def prepare(self, tasks, child_task_array):
+        pass
+
+    # a task submitted once the workflow is running
+    def add(self, task):
+        pass
+
+    def priority(self, task):
+        return 0
+
+# -------------------------------------------------------------------
+# critical path : dispatch the task with the largest upward rank first (HEFT),
+# the rank of a task is its cost plus the largest rank of its children,
+# i.e. the length of the longest remaining path to the end of the workflow
+class critical_path_priority:
+
+    def __init__(self, cost=default_task_cost):
+        self._cost = cost
+        self._rank = {}
+
+    def prepare(self, tasks, child_task_array):
+        # visit tasks children first (reverse topological order) without recursion
+        unvisited_children = {task.task_id(): len(child_task_array.get(task.task_id(), []))
+                              for task in tasks}
+        parents = {task.task_id(): set(task.dependent_task_array()) for task in tasks}
+        by_id = {task.task_id(): task for task in tasks}
+        stack = [task for task in tasks if unvisited_children[task.task_id()]==0]
+        self._rank = {}
+        while len(stack)!=0:
+            task = stack.pop()
+            children = child_task_array.get(task.task_id(), [])
+            self._rank[task.task_id()] = self._cost(task) + max(
+                [self._rank[child.task_id()] for child in children], default=0)
+            for parent in parents[task.task_id()]:
+                if parent in unvisited_children:
+                    unvisited_children[parent] -= 1
+                    if unvisited_children[parent]==0:
+                        stack.append(by_id[parent])
+        if len(self._rank)!=len(tasks):
+            print('Warning, task graph has a cycle, tasks on it have no rank')
+
+    # a task submitted while running has no children yet, its rank is its cost
+    # (the ranks of its parents are not revised)
+    def add(self, task):
+        self._rank[task.task_id()] = self._cost(task)
+
+    def rank(self, task):
+        return self._rank.get(task.task_id(), 0)
+
+    def priority(self, task):
+        return -self.rank(task)
+
+# -------------------------------------------------------------------
+# names accepted by splinter_workflow(priority_policy=...), an object with
+# prepare/priority methods may also be given
+def make_priority_policy(policy):
+    if policy=='fifo':
+        return fifo_priority()
+    elif policy=='critical_path':
+        return critical_path_priority()
+    elif isinstance(policy, str):
+        raise ValueError('Unknown priority policy ' + policy)
+    return policy
+
+# -------------------------------------------------------------------
+# placement policies understood by node_resources.find_node
+# most_memory : of the nodes that fit, use the one with the most free memory
+# best_fit    : use the node with the fewest free cores, then least free memory
+#               that fits (packs nodes tightly, leaves whole nodes free)
+# first_fit   : use the first node (in allocation order) that fits
+placement_policies = ('most_memory', 'best_fit', 'first_fit')
+
+# -------------------------------------------------------------------
+# index of free cores/memory per node used for task placement.
+# Nodes are bucketed by free core count, and each bucket is kept sorted
+# by (free memory, allocation order), so a fit query visits one bucket per
+# possible core count (bounded by the cores of the largest node) and does
+# a binary search in each, and an update is a remove/insert in one bucket.
+# first_fit uses a segment tree over the allocation order holding the most
+# free cores and memory of any node in each range, it descends to the
+# leftmost node that fits and an update rewrites one path to the root.
+class node_resources:
+
+    def __init__(self, resource_pool, policy='most_memory'):
+        if policy not in placement_policies:
+            raise ValueError('Unknown placement policy ' + str(policy))
+        self._policy    = policy
+        self._cpu_avail = {}
+        self._mem_avail = {}
+        self._order     = {}
+        max_cores = max([data[0] for data in resource_pool.values()], default=0)
+        self._buckets = [[] for i in range(max_cores+1)]
+        # segment tree, leaves from _size on in allocation order, -1 marks no node
+        self._size = 1
+        while self._size<len(resource_pool):
+            self._size *= 2
+        self._tree_cpu = [-1]*(2*self._size)
+        self._tree_mem = [-1]*(2*self._size)
+        self._by_order = list(resource_pool.keys())
+        for order, (node, data) in enumerate(resource_pool.items()):
+            self._order[node]     = order
+            self._cpu_avail[node] = data[0]
+            self._mem_avail[node] = data[1]
+            self._insert(node)
+
+    def _key(self, node):
+        return (self._mem_avail[node], self._order[node], node)
+
+    def _insert(self, node):
+        bisect.insort(self._buckets[self._cpu_avail[node]], self._key(node))
+        i = self._size + self._order[node]
+        self._tree_cpu[i] = self._cpu_avail[node]
+        self._tree_mem[i] = self._mem_avail[node]
+        i //= 2
+        while i>=1:
+            self._tree_cpu[i] = max(self._tree_cpu[2*i], self._tree_cpu[2*i+1])
+            self._tree_mem[i] = max(self._tree_mem[2*i], self._tree_mem[2*i+1])
+            i //= 2
+
+    def _remove(self, node):
+        bucket = self._buckets[self._cpu_avail[node]]
+        del bucket[bisect.bisect_left(bucket, self._key(node))]
+
+    def policy(self):
+        return self._policy
+
+    def nodes(self):
+        return self._order.keys()
+
+    def cpu_avail(self, node):
+        return self._cpu_avail[node]
+
+    # the most free cores of any node, from the highest non empty bucket
+    def max_cpu_avail(self):
+        for cores in range(len(self._buckets)-1, -1, -1):
+            if len(self._buckets[cores])!=0:
+                return cores
+        return 0
+
+    def fits(self, node, cores, memory):
+        return self._cpu_avail[node]>=cores and self._mem_avail[node]>=memory
+
+    def mem_avail(self, node):
+        return self._mem_avail[node]
+
+    # take resources from a node (task launched)
+    def acquire(self, node, cores, memory):
+        self._remove(node)
+        self._cpu_avail[node] -= cores
+        self._mem_avail[node] -= memory
+        self._insert(node)
+
+    # give resources back to a node (task completed)
+    def release(self, node, cores, memory):
+        self._remove(node)
+        self._cpu_avail[node] += cores
+        self._mem_avail[node] += memory
+        self._insert(node)
+
+    # return the node chosen by the placement policy for a task needing
+    # cores and memory, or None if no node currently has room for it.
+    # Nodes in exclude (e.g. where a task already failed, anything with in)
+    # are not considered, only the nodes the query reaches are looked up.
+    # policy overrides the placement policy of the index for this query
+    def find_node(self, cores, memory, exclude=None, policy=None):
+        policy = policy if policy is not None else self._policy
+        if policy=='first_fit':
+            return self._first_fit(cores, memory, exclude)
+        best = None
+        for bucket in itertools.islice(self._buckets, cores, None):
+            if len(bucket)==0:
+                continue
+            # first entry in this bucket with enough memory
+            index = bisect.bisect_left(bucket, (memory,))
+            if index==len(bucket):
+                continue
+            if policy=='best_fit':
+                # buckets are visited in order of free cores, first fit is tightest
+                while index<len(bucket) and exclude and bucket[index][2] in exclude:
+                    index += 1
+                if index<len(bucket):
+                    return bucket[index][2]
+            else:
+                # most_memory : the last entry of each bucket has the most memory
+                last = len(bucket) - 1
+                while last>=index and exclude and bucket[last][2] in exclude:
+                    last -= 1
+                if last>=index and (best is None or bucket[last][0]>best[0]):
+                    best = bucket[last]
+        return best[2] if best is not None else None
+
+    # lowest allocation order amongst the nodes that fit, subtrees without
+    # a node with enough cores and one with enough memory are skipped
+    def _first_fit(self, cores, memory, exclude):
+        stack = [1]
+        while len(stack)!=0:
+            i = stack.pop()
+            if self._tree_cpu[i]<cores or self._tree_mem[i]<memory:
+                continue
+            if i>=self._size:
+                node = self._by_order[i - self._size]
+                if self.fits(node, cores, memory) and not (exclude and node in exclude):
+                    return node
+                continue
+            # left (earlier nodes) first
+            stack.append(2*i + 1)
+            stack.append(2*i)
+        return None
+
+# -------------------------------------------------------------------
+# the nodes of an allocation and their free resources, shared by all the
+# workflows that run on it. Each workflow (the owner) takes resources for its
+# tasks from the pool, several workflows may be running at once from
+# different threads, so the pool holds the lock every scheduler uses while
+# it places or releases tasks.
+# Cpus are shared fairly : a workflow using more than its share (all cpus
+# divided by the number of running workflows) only gets more while no
+# workflow below its share is waiting, so a small workflow fills the cpus
+# that come free while a large one drains instead of queueing behind it.
+class node_pool:
+
+    # nodes is a dict of node name to (cpus, memory) and topology a dict of
+    # node name to splinter_topology.node_topology, when nodes is None the
+    # nodes of the allocation are discovered (see get_cached_node_data)
+    # schedulable_unit is 'core' (default) or 'pu' to count hardware threads
+    # cpu_binding binds each task to cores inside one NUMA domain where possible
+    # topology_ttl is the age (seconds) after which a cached topology is
+    # probed again (default splinter_topology.topology_cache.default_ttl)
+    def __init__(self, nodes=None, topology=None, schedulable_unit='core', cpu_binding=True,
+                 refresh_topology=False, discovery=None, topology_ttl=None):
+        self._schedulable_unit = schedulable_unit
+        self._cpu_binding = cpu_binding
+        self._job_id   = get_slurm_job()
+        self._nodes    = {}
+        self._topology = dict(topology) if topology is not None else {}
+        if nodes is not None:
+            self._nodes.update(nodes)
+        else:
+            node_list = get_slurm_nodelist()
+            node_info = get_cached_node_data(node_list, refresh=refresh_topology, ttl=topology_ttl,
+                                             job_id=self._job_id, discovery=discovery)
+            for node, record in node_info.items():
+                print('node', node, 'sockets {}, numa {}, cores {}, pus {}, memory(GB) {}'
+                      .format(record['sockets'], record['numa'], record['cores'], record['pus'], mem_gb(record['memory'])))
+                self._topology[node] = splinter_topology.node_topology.from_record(record)
+                # we will store tuple(cpus, memory) in our resource list
+                cpus = record['cores'] if schedulable_unit=='core' else record['pus']
+                self._nodes[node] = (cpus, record['memory'])
+        self._lock      = threading.RLock()
+        self._resources = None
+        self._core_sets = {}
+        # cpus in use, waiting state and wake up future of each running workflow
+        self._usage   = {}
+        self._waiting = {}
+        self._wakeups = {}
+        # free memory of each node as last reported by a completed task, less
+        # the memory reserved by the tasks launched there since
+        self._mem_available = {}
+
+    def job_id(self):
+        return self._job_id
+
+    def nodes(self):
+        return self._nodes
+
+    def topology(self):
+        return self._topology
+
+    def schedulable_unit(self):
+        return self._schedulable_unit
+
+    def lock(self):
+        return self._lock
+
+    def resources(self):
+        return self._resources
+
+    def core_sets(self):
+        return self._core_sets
+
+    def num_cpus(self):
+        return sum([data[0] for data in self._nodes.values()])
+
+    # -------------------------------------------------------------------
+    # a workflow starts running on the pool, the free resource index is
+    # rebuilt when nobody else is using it, so every run starts clean
+    def attach(self, owner, placement_policy='most_memory'):
+        with self._lock:
+            if len(self._usage)==0:
+                self._resources = node_resources(self._nodes, placement_policy)
+                # per node free cores in each NUMA domain, for binding
+                self._core_sets = {}
+                if self._cpu_binding:
+                    for node in self._nodes:
+                        if node in self._topology:
+                            self._core_sets[node] = splinter_topology.core_allocator(self._topology[node], self._schedulable_unit)
+                self._mem_available = {}
+            self._usage[owner] = 0
+            self._waiting[owner] = False
+
+    def detach(self, owner):
+        with self._lock:
+            self._usage.pop(owner, None)
+            self._waiting.pop(owner, None)
+            self._wakeups.pop(owner, None)
+            # whoever was held back for fairness may now take more
+            self._notify(owner)
+
+    # -------------------------------------------------------------------
+    # may owner take cpus more cpus, see the fair share rule above
+    def may_acquire(self, owner, cpus):
+        if self._usage[owner]==0 or len(self._usage)==1:
+            return True
+        share = self.num_cpus()/len(self._usage)
+        if self._usage[owner] + cpus<=share:
+            return True
+        for other, usage in self._usage.items():
+            if other is not owner and self._waiting[other] and usage<share:
+                return False
+        return True
+
+    # the owner has ready tasks that could not be placed
+    def set_waiting(self, owner, waiting):
+        self._waiting[owner] = waiting
+
+    # cpus used by the workflows other than owner
+    def used_elsewhere(self, owner):
+        with self._lock:
+            return sum([usage for other, usage in self._usage.items() if other is not owner])
+
+    def acquire(self, owner, node, cpus, memory):
+        self._resources.acquire(node, cpus, memory)
+        self._usage[owner] += cpus
+        if node in self._mem_available:
+            self._mem_available[node] -= memory
+
+    def release(self, owner, node, cpus, memory):
+        with self._lock:
+            self._resources.release(node, cpus, memory)
+            self._usage[owner] -= cpus
+            self._notify(owner)
+
+    # -------------------------------------------------------------------
+    # live free memory of a node, reported by the launcher with a completed task
+    def set_mem_available(self, node, memory):
+        with self._lock:
+            self._mem_available[node] = memory
+
+    # does the node have tasks running and less live free memory than memory,
+    # tasks already running there use more than was reserved for them
+    # (or something else does) and launching more could run the node out.
+    # An idle node is never short, whatever was last reported
+    def short_of_memory(self, node, memory):
+        free = self._mem_available.get(node)
+        return free is not None and free<memory and self._resources.cpu_avail(node)<self._nodes[node][0]
+
+    # has any node reported its live free memory
+    def mem_reported(self):
+        return len(self._mem_available)!=0
+
+    # -------------------------------------------------------------------
+    # a future that completes when another workflow releases resources,
+    # the owner waits on it together with its own tasks
+    def wakeup(self, owner):
+        with self._lock:
+            future = self._wakeups.get(owner)
+            if future is None or future.done():
+                future = concurrent.futures.Future()
+                self._wakeups[owner] = future
+            return future
+
+    def _notify(self, releaser):
+        for owner, future in self._wakeups.items():
+            if owner is not releaser and not future.done():
+                future.set_result(None)
+
+# -------------------------------------------------------------------
+# nodes a task is not placed on, given to node_resources.find_node as its
+# exclude : the nodes in excluded and those of the pool short of live free
+# memory for memory. Nodes are only checked as a fit query reaches them, so
+# the query does not visit every node that reported its free memory
+class node_exclusion:
+
+    def __init__(self, pool, memory, excluded=None):
+        self._pool     = pool
+        self._memory   = memory
+        self._excluded = excluded
+
+    def __contains__(self, node):
+        if self._excluded is not None and node in self._excluded:
+            return True
+        return self._pool.short_of_memory(node, self._memory)
+
+    def __bool__(self):
+        return self._excluded is not None or self._pool.mem_reported()
+
+# -------------------------------------------------------------------
+# the clock the scheduler runs on, wall clock time by default. A launcher
+# may bring a clock of its own (launcher.clock()), e.g. the virtual clock of
+# the simulator (see splinter_simulate) which jumps from one task
+# completion to the next instead of waiting for it.
+# The future of each launched task is given to watch(), a future completes
+# by putting itself on a queue that wait() blocks on, so waking up for a
+# completion costs the same however many tasks are in flight
+class wall_clock:
+
+    def __init__(self):
+        self._completed = queue.Queue()
+        # others futures already watched by wait
+        self._others = set()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def watch(self, future):
+        future.add_done_callback(self._completed.put)
+
+    def _other_done(self, future):
+        self._others.discard(future)
+        self._completed.put(future)
+
+    # wait until one of the watched futures, or of others, completes or
+    # timeout seconds have passed, returns the completed futures
+    def wait(self, others, timeout=None):
+        for future in others:
+            if future not in self._others:
+                self._others.add(future)
+                future.add_done_callback(self._other_done)
+        try:
+            done = set([self._completed.get(timeout=None if timeout is None else max(0, timeout))])
+        except queue.Empty:
+            return set()
+        while True:
+            try:
+                done.add(self._completed.get_nowait())
+            except queue.Empty:
+                return done
+
+# -------------------------------------------------------------------
+# what the scheduler does once a task has failed (non zero exit code, or
+# it could not be launched) and has no retries left
+# 'abort'           : launch nothing more, let running tasks finish and stop
+# 'continue'        : cancel the descendants of the failed task, the
+#                     independent branches of the graph carry on
+# 'retry_elsewhere' : as continue, but a failed task is retried at least
+#                     once and retries avoid the nodes it failed on
+failure_policies = ('abort', 'continue', 'retry_elsewhere')
+
 # -------------------------------------------------------------------
 # workflow object that represents a graph of nodes and has scheduling
 # operations to execute the graph on a set of resources that are discovered
 # at startup
 class splinter_workflow:
-    _task_array = []
-    _pending_task_array = []
-    _completed_task_array = []
-    _task_status_array = []
-
-    # these are the resources available on the system
-    _resource_pool = {}
-
-    # during execution, resources are consumed, we track availability here using node as key
-    # to dicts of CPU and memory (others can be added)
-    _cpu_avail = {}
-    _mem_avail = {}
+    # the task lists, pending tasks and resources are created per instance
+    # in __init__, so workflows never see each other's tasks
+    # (the defaults below are only settings)
+
+    # cores or PUs (SMT) as the unit counted in a task's cores
+    _schedulable_unit = 'core'
+    # bind each task to the cores allocated to it
+    _cpu_binding = True
+
+    # during execution, resources are consumed, we track availability here
+    # in an index of free CPU and memory per node (others can be added)
+    _resources = None
+    _placement_policy = 'most_memory'
+    # order in which ready tasks are dispatched
+    _priority_policy = 'critical_path'
     _max_jobs  = 1;
     _job_id    = 0
+    _history   = None
+    # seconds a ready task may wait for the node holding most of its input data
+    _locality_wait = 0
+    # write-ahead journal of the running workflow, if any
+    _journal   = None
+    # ready/submit/start/end times of the tasks of the last run
+    _trace     = None
+    # counters and gauges of the running (or last) workflow
+    _metrics   = None
+    # directory holding the stdout/stderr files of the tasks of the last run
+    _log_dir   = None
+    # what to do about failed tasks, see failure_policies. A failed task
+    # is retried max_retries times, after retry_backoff seconds the first
+    # time and twice as long each time after that
+    _failure_policy = 'continue'
+    _max_retries    = 0
+    _retry_backoff  = 1.0
+    # time used for scheduling decisions, see wall_clock
+    _clock = wall_clock()
+    # seconds between samples of the memory of running tasks, 0 to not
+    # measure the peak memory of tasks
+    _memory_interval = 0.5
+    # look up the peak memory of tasks run in srun steps with sacct once they
+    # end, off by default as each task then waits for the accounting database
+    _sacct_memory = False
+    # memory reserved for a task from the measured peaks in the history :
+    # the memory_percentile percentile plus a memory_headroom fraction, once
+    # there are memory_min_runs runs. None keeps the memory tasks are given
+    _memory_percentile = None
+    _memory_headroom   = 0.1
+    _memory_min_runs   = 3
+    # live free memory (bytes) a node must keep after a launch
+    _min_free_memory = 0
 
     # -------------------------------------------------------------------
     # construct. Init the resource pool with whatever nodes we have
-    def __init__(self):
-        self._job_id = get_slurm_job()
-        node_list = get_slurm_nodelist()
-        node_info = get_all_node_data(node_list)
-        for node, data in node_info.items():
-            print('node', node, 'sockets {}, numa {}, cores {}, pus {}, memory(GB) {}'
-                  .format(data[0], data[1], data[2], data[3], int(data[4]/(1024*1024*1024))))
-            # we will store tuple(cpus, memory) in our resource list
-            self._resource_pool[node] = (int(data[2]), data[4])
+    # placement_policy is one of placement_policies, default most_memory
+    # priority_policy is 'critical_path' (default), 'fifo' or a policy object
+    # history is a splinter_history.task_history (or a path to one) used to
+    # record every completed task and to estimate task costs
+    # locality_wait is how long (seconds) a ready task will wait for the node
+    # holding most of its input bytes rather than run elsewhere, 0 means a
+    # consumer only goes to its data when that node has room at the time
+    # schedulable_unit is 'core' (default) or 'pu' to count hardware threads
+    # cpu_binding binds each task to cores inside one NUMA domain where possible
+    # refresh_topology ignores the on disk topology cache and probes every node,
+    # topology_ttl is the age (seconds) after which a cached topology is probed again
+    # discovery is how nodes are probed, one of discovery_methods (default
+    # a single srun step inside a SLURM job, ssh otherwise)
+    # failure_policy is one of failure_policies (default continue),
+    # max_retries and retry_backoff (seconds) control retries of failed tasks
+    # memory_interval, sacct_memory, memory_percentile, memory_headroom and
+    # min_free_memory control the measurement of task memory and how it is used, see above
+    # pool is a node_pool shared with other workflows that may run at the
+    # same time, by default the workflow discovers the allocation and has a
+    # pool of its own (schedulable_unit, cpu_binding, refresh_topology,
+    # topology_ttl and discovery only apply then, a shared pool has its own settings)
+    def __init__(self, placement_policy=None, priority_policy=None, history=None, locality_wait=None,
+                 schedulable_unit=None, cpu_binding=None, refresh_topology=False, discovery=None,
+                 failure_policy=None, max_retries=None, retry_backoff=None, pool=None,
+                 memory_interval=None, memory_percentile=None, memory_headroom=None, min_free_memory=None,
+                 sacct_memory=None, topology_ttl=None):
+        self._task_array = []
+        # pending tasks by task id, (launched tasks are removed)
+        self._pending_tasks = {}
+        self._completed_task_array = []
+        # task_status of each task in flight, by the future of its launch
+        self._in_flight = {}
+        # tasks submitted while the workflow runs wait here for the scheduler,
+        # which is woken up through the _submitted future
+        self._submit_lock = threading.Lock()
+        self._submissions = []
+        self._submitted = concurrent.futures.Future()
+        self._submit_ids = itertools.count()
+        self._callbacks = {}
+        self._running = False
+        self._holds = 0
+        # set by cancel_workflow, and the queue completion events are posted to
+        self._cancel_requested = False
+        self._events = None
+        # stats() of the launcher of the last run
+        self._launch_stats = None
+        if failure_policy is not None:
+            if failure_policy not in failure_policies:
+                raise ValueError('Unknown failure policy ' + str(failure_policy))
+            self._failure_policy = failure_policy
+        if max_retries is not None:
+            self._max_retries = max_retries
+        if retry_backoff is not None:
+            self._retry_backoff = retry_backoff
+        if memory_interval is not None:
+            self._memory_interval = memory_interval
+        if sacct_memory is not None:
+            self._sacct_memory = sacct_memory
+        if memory_percentile is not None:
+            self._memory_percentile = memory_percentile
+        if memory_headroom is not None:
+            self._memory_headroom = memory_headroom
+        if min_free_memory is not None:
+            self._min_free_memory = min_free_memory
+        self._memory_estimates = {}
+        if schedulable_unit is not None:
+            self._schedulable_unit = schedulable_unit
+        if cpu_binding is not None:
+            self._cpu_binding = cpu_binding
+        if locality_wait is not None:
+            self._locality_wait = locality_wait
+        if isinstance(history, str):
+            history = splinter_history.task_history(history)
+        self._history = history
+        if placement_policy is not None:
+            self._placement_policy = placement_policy
+        if priority_policy is not None:
+            self._priority_policy = priority_policy
+        if pool is None:
+            pool = node_pool(schedulable_unit=self._schedulable_unit, cpu_binding=self._cpu_binding,
+                             refresh_topology=refresh_topology, discovery=discovery, topology_ttl=topology_ttl)
+        self._pool = pool
+        self._job_id = pool.job_id()
+        self._schedulable_unit = pool.schedulable_unit()
+        # these are the resources available on the system
+        self._resource_pool = pool.nodes()
+        # and the socket/numa/core/PU layout of each node
+        self._topology = pool.topology()
 
+    def pool(self):
+        return self._pool
 
     # -------------------------------------------------------------------
-    # This should be called before executing a new workflow to ensure
-    # resources are reset to their initial state
+    # This should be called before executing a new workflow, it joins the
+    # workflows running on the pool, if there are none the resources are
+    # reset to their initial state
     def init_resources(self):
+        self._pool.attach(self, self._placement_policy)
+        self._resources = self._pool.resources()
+        # per node free cores in each NUMA domain, for binding
+        self._core_sets = self._pool.core_sets()
         self._max_jobs  = 0;
         for node, data in self._resource_pool.items():
-            self._cpu_avail[node] = data[0]
-            self._mem_avail[node] = data[1]
             # to tell the executor the max number of "threads" we 'might' need
             self._max_jobs += data[0];
 
+    # -------------------------------------------------------------------
+    # tasks without a cost estimate get the median duration of previous runs
+    # of the same transformation (and data size) from the history
+    def estimate_task_costs(self):
+        if self._history is None:
+            return
+        estimates = {}
+        for task in self._pending_tasks.values():
+            if task.cost() is not None:
+                continue
+            key = (task.name(), splinter_history.argument_data_size(task.command()[1:]))
+            if key not in estimates:
+                estimates[key] = self._history.predict_duration(*key)
+            task.set_cost(estimates[key])
+
+    # -------------------------------------------------------------------
+    # with a memory_percentile, tasks of a transformation (and data size)
+    # measured often enough reserve what they were seen to need rather than
+    # the memory they were given, which may be far more (the nodes are
+    # underpacked) or less (they run out of memory). Never more than a node has
+    def estimate_task_memory(self, tasks):
+        if self._history is None or self._memory_percentile is None:
+            return
+        largest = max([data[1] for data in self._resource_pool.values()])
+        for task in tasks:
+            key = (task.name(), splinter_history.argument_data_size(task.command()[1:]))
+            if key not in self._memory_estimates:
+                peak = self._history.predict_memory(*key, p=self._memory_percentile,
+                                                    min_runs=self._memory_min_runs)
+                self._memory_estimates[key] = None if peak is None else \
+                    min(largest, int(peak*(1 + self._memory_headroom)))
+            if self._memory_estimates[key] is not None:
+                task.set_memory(self._memory_estimates[key])
+
+    # -------------------------------------------------------------------
+    # add a completed task to the history, the time measured where the task
+    # ran is used when the launcher reports it
+    def record_task_history(self, task_status):
+        if self._history is None:
+            return
+        task = task_status.task()
+        exit_code, start_time, end_time = task_status.outcome()
+        self._history.record(task.name(), task.command()[1:], task.node(),
+                             task.cores(), task.memory(), end_time - start_time, exit_code,
+                             task_status.peak_memory())
+
     # -------------------------------------------------------------------
     # method to add a task to the graph of work
     def add_task(self, task):
         self._task_array.append(task)
 
+    # -------------------------------------------------------------------
+    # create a task and add it to the workflow, before or during execution
+    # (from any thread, or from a callback), the task returned is the handle
+    # to use as a dependency of tasks submitted later.
+    # deps are tasks or task ids, task_id defaults to 'submit.<n>'.
+    # callback(task, exit_code) is called by the scheduler once the task has
+    # completed, failed for good or was cancelled (exit_code None when it
+    # never ran), tasks it submits are scheduled at once, which allows fan
+    # out that depends on the results of a task
+    def submit(self, command, deps=(), cores=1, memory=0, name=None, inputs=None, outputs=None,
+               task_id=None, callback=None):
+        if task_id is None:
+            task_id = 'submit.' + str(next(self._submit_ids))
+        parents = [dep.task_id() if hasattr(dep, 'task_id') else dep for dep in deps]
+        new_task = task(task_id, command, parents, cores, memory, name=name, inputs=inputs, outputs=outputs)
+        if callback is not None:
+            self._callbacks[task_id] = callback
+        with self._submit_lock:
+            if not self._running:
+                self.add_task(new_task)
+                return new_task
+            self._submissions.append(new_task)
+            if not self._submitted.done():
+                self._submitted.set_result(None)
+        return new_task
+
+    # -------------------------------------------------------------------
+    # keep the workflow running, even with nothing left to do, while tasks
+    # are still being submitted from another thread
+    #   with wf.submitting():
+    #       for chunk in generator: wf.submit(...)
+    @contextlib.contextmanager
+    def submitting(self):
+        with self._submit_lock:
+            self._holds += 1
+        try:
+            yield self
+        finally:
+            with self._submit_lock:
+                self._holds -= 1
+                if not self._submitted.done():
+                    self._submitted.set_result(None)
+
+    # -------------------------------------------------------------------
+    # add the tasks submitted since the last pass to the running graph, a
+    # task whose parents have all completed is ready at once, one with a
+    # parent that failed is cancelled
+    def register_submitted_tasks(self):
+        with self._submit_lock:
+            submissions = self._submissions
+            self._submissions = []
+            if self._submitted.done():
+                self._submitted = concurrent.futures.Future()
+        for new_task in submissions:
+            task_id = new_task.task_id()
+            self._task_array.append(new_task)
+            self._pending_tasks[task_id] = new_task
+            parents = set(new_task.dependent_task_array()).difference(self._completed_ids)
+            if self._aborted or len(parents.intersection(self._dropped_ids))!=0:
+                self.cancel_task(new_task)
+                continue
+            for parent in parents:
+                self._child_task_array.setdefault(parent, []).append(new_task)
+            self._remaining_parents[task_id] = len(parents)
+            if hasattr(self._priority, 'add'):
+                self._priority.add(new_task)
+            self.estimate_task_memory([new_task])
+            if len(parents)==0:
+                self.push_ready_task(new_task)
+
+    # -------------------------------------------------------------------
+    # run the workflow in a background thread, returns a workflow_run handle
+    # to follow its progress, wait for it or cancel it. The arguments are
+    # those of execute_workflow
+    def start_workflow(self, poll_frequency, srun, **kwargs):
+        return workflow_run(self, poll_frequency, srun, kwargs)
+
+    # -------------------------------------------------------------------
+    # stop the running workflow from any thread : nothing more is launched
+    # and the tasks in flight are killed (their srun steps are cancelled),
+    # ignored when the workflow is not running
+    def cancel_workflow(self):
+        with self._submit_lock:
+            if not self._running:
+                return
+            self._cancel_requested = True
+            if not self._submitted.done():
+                self._submitted.set_result(None)
+
+    # -------------------------------------------------------------------
+    # counts of tasks by state
+    def progress(self):
+        running   = len(self._in_flight)
+        completed = len(self._completed_task_array)
+        failed    = len(getattr(self, '_failed_task_array', []))
+        cancelled = len(getattr(self, '_cancelled_task_array', []))
+        pending   = len(self._pending_tasks) + len(self._submissions)
+        return {'completed': completed, 'failed': failed, 'cancelled': cancelled,
+                'running': running, 'pending': pending,
+                'total': completed + failed + cancelled + running + pending}
+
+    # -------------------------------------------------------------------
+    # a task completed, failed for good or was cancelled (state), this is
+    # posted to the run handle's event queue when there is one
+    def post_event(self, task, state, exit_code=None):
+        if self._events is not None:
+            self._events.put({'task': task, 'state': state, 'exit_code': exit_code, 'time': self._clock.time()})
+
+    # -------------------------------------------------------------------
+    # a task has completed, or failed for good, tell whoever submitted it
+    def run_callback(self, task, exit_code):
+        callback = self._callbacks.pop(task.task_id(), None)
+        if callback is not None:
+            callback(task, exit_code)
+
     # -------------------------------------------------------------------
     # a job that has been launched has a status object that knows
     # when it completes via a future and holds other information about the job
-    def completed_task_status(self):
-        for task_status in self._task_status_array:
-            if task_status.future().done():
-                task = task_status.task()
-                node = task.node()
-                self._cpu_avail[node] += task.cores()
-                self._mem_avail[node] += task.memory()
-                return task_status
-        return None
+    # called once for each status whose future has finished, returns the
+    # resources held by the task to the node it ran on
+    def completed_task_status(self, task_status):
+        task = task_status.task()
+        node = task.node()
+        with self._pool.lock():
+            if task.cpu_units() is not None:
+                self._core_sets[node].release(task.cpu_units())
+                task.set_cpus(None, None)
+            self._pool.release(self, node, task.cores(), task.memory())
+        return task_status
 
     # -------------------------------------------------------------------
     # returns true if jobs still remain that need to be executed or
     # have not yet completed runnning
     def is_workflow_active(self):
-        if len(self._pending_task_array) != 0:
+        if len(self._pending_tasks) != 0:
             return True
 
-        if len(self._task_status_array) != 0:
+        if not self._aborted and (len(self._submissions) != 0 or self._holds != 0):
+            return True
+
+        if len(self._in_flight) != 0:
             return True
 
         return False
 
+    # -------------------------------------------------------------------
+    # build the child adjacency lists and the count of unfinished parents
+    # for each task, tasks with no parents go straight into the ready queue.
+    # After this, dependencies are only touched when a task completes,
+    # so each launch/completion costs O(number of children)
+    # The ready queue is a heap ordered by the priority policy
+    # completed holds the ids of tasks that finished in an earlier (journaled)
+    # run, they no longer count as parents
+    def init_dependencies(self, completed=()):
+        self._child_task_array = {}
+        self._remaining_parents = {}
+        self._ready_queue = []
+        self._ready_order = itertools.count()
+        self._ready_time = {}
+        # number of ready (or deferred) tasks of each (cores, memory)
+        self._ready_shapes = {}
+        # node on which each file/CDO was produced
+        self._data_location = {}
+        self._deferred_queue = []
+        # failed tasks waiting to be retried, a heap ordered by due time
+        self._retry_queue = []
+        self._attempts = {}
+        self._failed_nodes = {}
+        self._failed_task_array = []
+        self._cancelled_task_array = []
+        self._aborted = False
+        # ids of the tasks that completed, and of those that failed for good or were cancelled
+        self._completed_ids = set(completed)
+        self._dropped_ids = set()
+        roots = []
+        for task in self._pending_tasks.values():
+            # a parent listed twice must only be counted once
+            parents = set(task.dependent_task_array()).difference(completed)
+            for parent in parents:
+                if parent not in self._pending_tasks:
+                    print('Warning, task', task.task_id(), 'depends on unknown task', parent)
+                self._child_task_array.setdefault(parent, []).append(task)
+            self._remaining_parents[task.task_id()] = len(parents)
+            if len(parents)==0:
+                roots.append(task)
+        # priorities may depend on the whole graph, compute them before anything is queued
+        self._priority = make_priority_policy(self._priority_policy)
+        self._priority.prepare(list(self._pending_tasks.values()), self._child_task_array)
+        for task in roots:
+            self.push_ready_task(task)
+
+    # -------------------------------------------------------------------
+    # add a task whose dependencies are all satisfied to the ready queue
+    def push_ready_task(self, task):
+        self._ready_time[task.task_id()] = self._clock.time()
+        if self._trace is not None:
+            self._trace.ready(task)
+        heapq.heappush(self._ready_queue, (self._priority.priority(task), next(self._ready_order), task))
+        shape = (task.cores(), task.memory())
+        self._ready_shapes[shape] = self._ready_shapes.get(shape, 0) + 1
+
     # -------------------------------------------------------------------
     # returns true when a job can run because any other jobs it depends on
     # have completed (or it has no dependencies)
     def are_task_dependencies_satisfied(self, task):
-        if len(task.dependent_task_array())==0:
-            return True
+        return self._remaining_parents[task.task_id()]==0
 
-        completed_task_id_array = [task.task_id() for task in self._completed_task_array]
-        pending_task_id_array = [task.task_id() for task in self._pending_task_array]
-        # race? : if a task completes whilst we are iterating this list? (should not matter)
-        for dependent_task in task.dependent_task_array():
-            # if a parent task isn't marked as completed, we cannot run
-            if not dependent_task in completed_task_id_array:
-                return False
-            # if a parent task has not run yet, we cannot run
-            if dependent_task in pending_task_id_array:
+    # -------------------------------------------------------------------
+    # when a task completes, decrement the parent count of its children
+    # and move any that are now free of dependencies to the ready queue,
+    # children no longer pending (the workflow was aborted or cancelled while
+    # the task ran) stay dropped
+    def release_child_tasks(self, task):
+        for child in self._child_task_array.get(task.task_id(), []):
+            self._remaining_parents[child.task_id()] -= 1
+            if self._remaining_parents[child.task_id()]==0 and child.task_id() in self._pending_tasks:
+                self.push_ready_task(child)
+
+    # -------------------------------------------------------------------
+    # ready tasks that did not fit anywhere in the last pass are deferred,
+    # once resources have been released they are given another chance,
+    # they keep their original place in the priority order
+    def requeue_deferred_tasks(self):
+        if len(self._deferred_queue)>=len(self._ready_queue):
+            # rebuilding the heap is linear, cheaper than pushing each entry
+            self._ready_queue += self._deferred_queue
+            heapq.heapify(self._ready_queue)
+        else:
+            for entry in self._deferred_queue:
+                heapq.heappush(self._ready_queue, entry)
+        self._deferred_queue = []
+
+    # -------------------------------------------------------------------
+    # a completed task leaves its outputs on the node it ran on
+    def record_data_location(self, task):
+        for name in task.outputs():
+            self._data_location[name] = task.node()
+
+    # -------------------------------------------------------------------
+    # bytes of the inputs of a task already present on each node
+    def local_input_bytes(self, task):
+        local = {}
+        for name, size in task.inputs().items():
+            node = self._data_location.get(name)
+            if node is not None:
+                local[node] = local.get(node, 0) + (size or 0)
+        return local
+
+    # -------------------------------------------------------------------
+    # data locality : nodes are scored by the input bytes they already hold.
+    # returns the best scoring node that has room for the task, False if the
+    # task should keep waiting for the best node (it has not yet waited
+    # locality_wait seconds) or None to leave the choice to the placement policy
+    def find_local_node(self, task):
+        if len(task.inputs())==0 or len(self._data_location)==0:
+            return None
+        local = self.local_input_bytes(task)
+        if len(local)==0:
+            return None
+        exclude = self.unusable_nodes(task)
+        if exclude is not None:
+            local = {node: nbytes for node, nbytes in local.items() if node not in exclude}
+        ranked = sorted(local.items(), key=lambda item: item[1], reverse=True)
+        waited = self._clock.time() - self._ready_time.get(task.task_id(), 0)
+        for i, (node, nbytes) in enumerate(ranked):
+            if self._resources.fits(node, task.cores(), task.memory()):
+                return node
+            if i==0 and waited<self._locality_wait:
                 return False
-        return True
+        return None
 
     # -------------------------------------------------------------------
     # return True if there is a worker available that can run this job
     # free workers might not have enough cpu/memory/other to run a particular job
     # This function changes resources available, so if it returns True,
     # you must launch the task, otherwise resources tracking will be incorrect
+    # The pool may be shared with other running workflows, placement is done
+    # under its lock, and a task is held back when the workflow is above its
+    # fair share of the cpus and another workflow is waiting
+    # _unplaceable is set when the task was turned down for want of
+    # resources alone, so that no larger task can be placed either
     def is_worker_available(self, task):
-        best_node = None
-        best_mem  = 0
-        for (node1,cpus), (node2,mem) in zip(self._cpu_avail.items(), self._mem_avail.items()):
-            if node1!=node2:
-                raise "Fatal : Nodes do not match in resource dictionaries"
-            # if this task can run on this node
-            # pick the best node to use (based on memory avail)
-            if cpus>task.cores() and mem>task.memory():
-                if best_node is not None:
-                    if mem>best_mem:
-                        best_node = node1
-                        best_mem = mem
-                else:
-                    best_node = node1
-                    best_mem = mem
-        if best_node is not None:
-            # decrement resources
-            self._cpu_avail[best_node] = self._cpu_avail[best_node] - task.cores()
-            self._mem_avail[best_node] = self._mem_avail[best_node] - task.memory()
-            task.set_node(best_node)
-            print('node {}, cpus {}, GB {}'.format(best_node, self._cpu_avail[best_node], mem_gb(self._mem_avail[best_node])))
-            return True        
-        # didn't fin a node with enough resources
+        self._unplaceable = False
+        with self._pool.lock():
+            if not self._pool.may_acquire(self, task.cores()):
+                self._unplaceable = True
+                return False
+            best_node = self.find_local_node(task)
+            if best_node is False:
+                # waiting for the node that holds the data
+                return False
+            if best_node is None:
+                best_node = self._resources.find_node(task.cores(), task.memory(), self.unusable_nodes(task),
+                                                      self._placement_policy)
+            if best_node is not None:
+                # decrement resources
+                self._pool.acquire(self, best_node, task.cores(), task.memory())
+                task.set_node(best_node)
+                if best_node in self._core_sets:
+                    units = self._core_sets[best_node].allocate(task.cores())
+                    task.set_cpus(units, self._core_sets[best_node].pus(units))
+                print('node {}, cpus {}, GB {}'.format(best_node, self._resources.cpu_avail(best_node), mem_gb(self._resources.mem_avail(best_node))))
+                return True
+        # didn't find a node with enough resources
+        self._unplaceable = self.excluded_nodes(task) is None
         return False
 
     # -------------------------------------------------------------------
-    # (greedy) method to get the next task to run, returns the next available
-    # task that fits in available resources
+    # nodes a retried task should not be placed on (those it failed on, with
+    # the retry_elsewhere policy) as long as that leaves some node to use
+    def excluded_nodes(self, task):
+        failed = self._failed_nodes.get(task.task_id())
+        if failed is None or len(failed)>=len(self._resource_pool):
+            return None
+        return failed
+
+    # -------------------------------------------------------------------
+    # nodes a task is not placed on now : those it should avoid after a
+    # failure and those short of live free memory for it (see node_exclusion),
+    # None if none
+    def unusable_nodes(self, task):
+        excluded = self.excluded_nodes(task)
+        if not self._pool.mem_reported():
+            return excluded
+        return node_exclusion(self._pool, task.memory() + self._min_free_memory, excluded)
+
+    # -------------------------------------------------------------------
+    # a task finished with a non zero exit code (or could not be launched).
+    # It is retried after a backoff while it has retries left, after that it
+    # has failed for good and the failure policy decides what else is run
+    def task_failed(self, task, exit_code):
+        attempts = self._attempts.get(task.task_id(), 0) + 1
+        self._attempts[task.task_id()] = attempts
+        retries = self._max_retries
+        if self._failure_policy=='retry_elsewhere':
+            retries = max(1, retries)
+            self._failed_nodes.setdefault(task.task_id(), set()).add(task.node())
+        if attempts<=retries and not self._aborted:
+            delay = self._retry_backoff * 2**(attempts-1)
+            print('Task', task.task_id(), 'failed with exit code', exit_code, 'on', task.node(),
+                  ': retry', attempts, 'of', retries, 'in', delay, 's')
+            self._pending_tasks[task.task_id()] = task
+            heapq.heappush(self._retry_queue, (self._clock.time() + delay, next(self._ready_order), task))
+            return
+        print('Task', task.task_id(), 'failed with exit code', exit_code, 'on', task.node())
+        self._failed_task_array.append(task)
+        self._dropped_ids.add(task.task_id())
+        self.post_event(task, 'failed', exit_code)
+        self.run_callback(task, exit_code)
+        if self._failure_policy=='abort':
+            self.abort_workflow()
+        else:
+            self.cancel_descendants(task)
+
+    # -------------------------------------------------------------------
+    # a task will not run (to completion) : an ancestor failed, the workflow
+    # was aborted, or it was killed by cancel_workflow (with its exit code).
+    # It is posted as cancelled and whoever submitted it is told
+    def cancel_task(self, task, exit_code=None):
+        self._pending_tasks.pop(task.task_id(), None)
+        self._cancelled_task_array.append(task)
+        self._dropped_ids.add(task.task_id())
+        self.post_event(task, 'cancelled', exit_code)
+        self.run_callback(task, exit_code)
+
+    # -------------------------------------------------------------------
+    # tasks that can never run because an ancestor failed are dropped at
+    # once, rather than waiting for parents that will not complete
+    def cancel_descendants(self, task):
+        stack = [task]
+        while len(stack)!=0:
+            for child in self._child_task_array.get(stack.pop().task_id(), []):
+                if child.task_id() in self._pending_tasks:
+                    self.cancel_task(child)
+                    stack.append(child)
+
+    # -------------------------------------------------------------------
+    # nothing more is launched, tasks already running are left to finish
+    def abort_workflow(self):
+        print('Aborting workflow,', len(self._pending_tasks), 'tasks will not run')
+        self._aborted = True
+        for task in list(self._pending_tasks.values()):
+            self.cancel_task(task)
+        self._ready_queue = []
+        self._deferred_queue = []
+        self._retry_queue = []
+        self._ready_shapes = {}
+
+    # -------------------------------------------------------------------
+    # failed tasks whose backoff has expired go back to the ready queue
+    def release_due_retries(self):
+        now = self._clock.time()
+        while len(self._retry_queue)!=0 and self._retry_queue[0][0]<=now:
+            self.push_ready_task(heapq.heappop(self._retry_queue)[2])
+
+    # tasks that failed for good, and tasks not run because of a failure
+    def failed_tasks(self):
+        return self._failed_task_array
+
+    def cancelled_tasks(self):
+        return self._cancelled_task_array
+
+    # launch counts and latencies of the last run (see splinter_launch.launch_stats),
+    # None when its launcher keeps none
+    def launch_stats(self):
+        return self._launch_stats
+
+    # -------------------------------------------------------------------
+    # True when every ready task needs at least the cores and memory of one
+    # of blocked, so none of them can be placed. Only checked while there
+    # are few distinct task shapes, which is the usual case
+    def all_ready_blocked(self, blocked):
+        if len(self._ready_shapes)>64:
+            return False
+        return all([any([shape[0]>=b[0] and shape[1]>=b[1] for b in blocked]) for shape in self._ready_shapes])
+
+    # -------------------------------------------------------------------
+    # (greedy) method to get the next task to run, returns the highest priority
+    # ready task that fits in available resources
     # Warning:
     # This function changes pending tasks and resources available, so if it returns a task,
     # you must launch it, otherwise resources will be lost and job tracking will fail
     def find_next_task(self):
-        n_pending_task = len(self._pending_task_array)
-        if n_pending_task != 0:
-            for i in range(0, n_pending_task):
-                task = self._pending_task_array[i]
-                if self.are_task_dependencies_satisfied(task) and self.is_worker_available(task):
-                    # update pending tasks
-                    self._pending_task_array.remove(task)
-                    return task
+        # each ready task is tried at most once per scheduling pass,
+        # those that do not fit wait in the deferred queue.
+        # (cores, memory) of the tasks that did not fit anywhere, a task
+        # needing at least as much of both is deferred without being tried,
+        # to start with those needing more cores than any node has free
+        with self._pool.lock():
+            max_cores = self._resources.max_cpu_avail()
+        if max_cores==0:
+            # every cpu is busy, nothing can be placed in this pass
+            self._deferred_queue += self._ready_queue
+            self._ready_queue = []
+            return None
+        blocked = [(max_cores + 1, 0)]
+        while len(self._ready_queue) != 0:
+            if self.all_ready_blocked(blocked):
+                self._deferred_queue += self._ready_queue
+                self._ready_queue = []
+                return None
+            entry = heapq.heappop(self._ready_queue)
+            task = entry[2]
+            cores, memory = task.cores(), task.memory()
+            if any([cores>=shape[0] and memory>=shape[1] for shape in blocked]):
+                self._deferred_queue.append(entry)
+                continue
+            if self.is_worker_available(task):
+                # update pending tasks
+                del self._pending_tasks[task.task_id()]
+                self._ready_shapes[(cores, memory)] -= 1
+                if self._ready_shapes[(cores, memory)]==0:
+                    del self._ready_shapes[(cores, memory)]
+                return task
+            if self._unplaceable:
+                blocked.append((cores, memory))
+            self._deferred_queue.append(entry)
         return None
 
+    # -------------------------------------------------------------------
+    # execution trace of the last run (see splinter_trace), export it with
+    # trace().write_chrome(path) or trace().write_csv(path)
+    def trace(self):
+        return self._trace
+
+    # live metrics of the running (or last) run, see splinter_metrics
+    def metrics(self):
+        return self._metrics
+
+    def log_dir(self):
+        return self._log_dir
+
+    # -------------------------------------------------------------------
+    # the directory task output goes to, log_dir itself when given, otherwise
+    # a new directory per run under ./splinter-logs. os.devnull discards output
+    def make_log_dir(self, log_dir):
+        if log_dir is None:
+            base = os.path.join(os.getcwd(), 'splinter-logs')
+            os.makedirs(base, exist_ok=True)
+            log_dir = tempfile.mkdtemp(prefix=time.strftime('%Y%m%d-%H%M%S-'), dir=base)
+        elif log_dir!=os.devnull:
+            os.makedirs(log_dir, exist_ok=True)
+        print('Task output in', log_dir)
+        return log_dir
+
+    # (node, free cpus, cpus, free memory, memory) of every node
+    def node_usage(self):
+        return [(node, self._resources.cpu_avail(node), self._resource_pool[node][0],
+                 self._resources.mem_avail(node), self._resource_pool[node][1])
+                for node in list(self._resources.nodes())]
+
+    # NUMA domain of the cpus a task is bound to, -1 when it is not bound
+    def task_numa_domain(self, task):
+        if task.cpu_units() is None:
+            return -1
+        return self._core_sets[task.node()].domain(task.cpu_units()[0])
+
+    # -------------------------------------------------------------------
+    # journal records of the pending tasks that need not run again, a task
+    # the journal has as completed still runs when any of its ancestors does
+    def journaled_tasks(self, path):
+        records = splinter_journal.completed_tasks(path, self._pending_tasks)
+        children = {}
+        for task in self._pending_tasks.values():
+            for parent in set(task.dependent_task_array()):
+                children.setdefault(parent, []).append(task.task_id())
+        rerun = [task_id for task_id in self._pending_tasks if task_id not in records]
+        while len(rerun)!=0:
+            for child in children.get(rerun.pop(), []):
+                if child in records:
+                    del records[child]
+                    rerun.append(child)
+        return records
+
+    # -------------------------------------------------------------------
+    # start journaling the run, when resuming the tasks the journal records
+    # as completed are taken out of the pending tasks and marked completed,
+    # returns them as a dict of task id to task
+    def open_journal(self, journal, resume):
+        completed = {}
+        if journal is None:
+            return completed
+        if isinstance(journal, str):
+            path = journal
+            journal = None
+        else:
+            path = journal.path()
+        if resume:
+            for task_id, record in self.journaled_tasks(path).items():
+                task = self._pending_tasks.pop(task_id)
+                task.set_node(record['node'])
+                self._completed_task_array.append(task)
+                completed[task_id] = task
+            print('Resuming from journal', path, ':', len(completed), 'tasks already completed,',
+                  len(self._pending_tasks), 'to run')
+        if journal is None:
+            journal = splinter_journal.task_journal(path, resume)
+        self._journal = journal
+        self._journal.start(len(self._pending_tasks), len(completed))
+        return completed
+
     # -------------------------------------------------------------------
     # this function will execute a graph of work
     # the user must create tasks, with dependencies and
-    def execute_workflow(self, poll_frequency, srun):
-        self._pending_task_array = self._task_array
+    # Completion is event driven : the loop blocks on the queue of completed
+    # futures (see wall_clock) until at least one in flight task finishes,
+    # then releases its resources and launches whatever became ready, so no
+    # time is lost between a parent finishing and its children starting and
+    # no cpu is used whilst idle.
+    # poll_frequency is kept for compatibility with existing callers, it is
+    # now only the interval (seconds, minimum 5) between status reports
+    # launcher selects how commands are started (see splinter_launch.launchers)
+    # 'threads' : one thread per running task blocked waiting for its process
+    # 'asyncio' : all tasks driven from a single event loop
+    # 'agent'   : one persistent launch agent per node, tasks are streamed to it
+    # 'null'    : nothing is run, tasks succeed at once (to time the scheduler)
+    # 'local', 'srun', 'ssh' : as asyncio, with tasks run locally, in srun
+    #             steps, or over ssh on their node whatever srun is
+    # or a launcher object (see splinter_launch.launcher), prepare() and
+    # stats() are used when it has them, one with a clock() method also sets
+    # the clock the scheduler runs on
+    # journal is a path (or splinter_journal.task_journal) to which every task
+    # submission and completion is written, with resume the tasks the journal
+    # records as completed are not run again
+    # trace is a path prefix, when given the execution trace is written to
+    # <trace>.json (Chrome trace) and <trace>.csv once the run ends
+    # metrics_port serves live metrics in Prometheus format on that port
+    # (0 picks a free port) at /metrics while the workflow runs, on
+    # metrics_address, only reachable from this host by default ('' serves
+    # on every interface)
+    # log_dir is where each task writes <task id>.out/.err (default a new
+    # directory under ./splinter-logs, os.devnull to discard task output)
+    # returns True when every task completed successfully, failed_tasks()
+    # and cancelled_tasks() list those that did not
+    def execute_workflow(self, poll_frequency, srun, launcher='threads', journal=None, resume=False,
+                         trace=None, metrics_port=None, log_dir=None, metrics_address='127.0.0.1'):
+        with self._submit_lock:
+            # a run started by start_workflow is already running, and may
+            # already have been cancelled
+            if not self._running:
+                self._cancel_requested = False
+            self._running = True
+        self._clock = launcher.clock() if hasattr(launcher, 'clock') else wall_clock()
+        self._pending_tasks = {task.task_id(): task for task in self._task_array}
+        # reset before the journal adds the tasks a resumed run has completed,
+        # the rest of the per run state is reset by init_dependencies
+        self._completed_task_array = []
+        completed = self.open_journal(journal, resume)
+        # the trace keeps to the monotonic clock unless the time is virtual
+        trace_clock = None if isinstance(self._clock, wall_clock) else self._clock.time
+        self._trace = splinter_trace.task_trace(self._pending_tasks.values(), trace_clock)
+        self.estimate_task_costs()
+        self._memory_estimates = {}
+        self.estimate_task_memory(self._pending_tasks.values())
+        self.init_dependencies(completed)
+        for task in completed.values():
+            self.record_data_location(task)
 
         # initialize resource lists
         self.init_resources()
-        last_now = time.time()
+        report_interval = max(5, poll_frequency)
+        last_now = self._clock.time()
+        self._log_dir = self.make_log_dir(log_dir)
+        self._metrics = splinter_metrics.workflow_metrics(self.node_usage, self._clock.time)
+        if metrics_port is not None:
+            self._metrics.serve(metrics_port, metrics_address)
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_jobs) as executor:
-            poll_loop = 0
+        if isinstance(launcher, str):
+            launcher = splinter_launch.make_launcher(launcher, self._max_jobs, srun, self._job_id,
+                                                     self._resource_pool, self._memory_interval, self._sacct_memory)
+        if hasattr(launcher, 'prepare'):
+            launcher.prepare(self._resource_pool)
+        try:
+            self._in_flight = {}
+            in_flight = self._in_flight
             while self.is_workflow_active():
-                completed_task_id_array = [task.task_id() for task in self._completed_task_array]
-                pending_task_id_array = [task.task_id() for task in self._pending_task_array]
-                in_flight_id_array    = [status.task().task_id() for status in self._task_status_array]
-
-                now = time.time()
-                if (now-last_now>5):
-                    print('Poll loop', poll_loop,
-                          '\nCompleted tasks', completed_task_id_array,
-                          '\nPending tasks', pending_task_id_array,
-                          '\nIn flight', in_flight_id_array)
-                    last_now = now
-
-                # Launch as many tasks as possible in each polling window
+                loop_start = time.perf_counter()
+                self.register_submitted_tasks()
+                if self._cancel_requested and not self._aborted:
+                    self.abort_workflow()
+                    for status in in_flight.values():
+                        launcher.kill(status.task())
+                self.release_due_retries()
+                # Launch as many tasks as possible
                 task = self.find_next_task()
                 while task is not None:
                     print("Submitting Job", task.task_id(), task.command())
-                    if srun:
-                        future = execute_srun(executor, self._job_id, task.node(), task.command())
-                    else:
-                        future = executor.submit(subprocess.run, task.command(), stdout=subprocess.PIPE)
-                    self._task_status_array.append(task_status(task, future))
+                    logs = splinter_launch.task_log_paths(self._log_dir, task, self._attempts.get(task.task_id(), 0))
+                    launch_time = self._clock.time()
+                    future = launcher.launch(task, logs)
+                    self._trace.submitted(task, len(in_flight), self.task_numa_domain(task))
+                    if self._journal is not None:
+                        self._journal.submitted(task)
+                    status = task_status(task, future, logs, launch_time)
+                    in_flight[future] = status
+                    self._clock.watch(future)
+                    self._metrics.launched()
                     # any more tasks ready to execute?
                     task = self.find_next_task()
 
-                # Clear as many tasks as possible in each polling window
-                completed_task_status = self.completed_task_status()
-                while completed_task_status is not None:
+                self._pool.set_waiting(self, len(self._deferred_queue)!=0)
+                # another workflow on the pool freeing resources also wakes us up,
+                # as does a task being submitted
+                wakeup = self._pool.wakeup(self)
+                submitted = self._submitted
+                if len(in_flight)==0 and len(self._retry_queue)!=0:
+                    # only failed tasks waiting for their retry
+                    self._clock.sleep(max(0, self._retry_queue[0][0] - self._clock.time()))
+                    continue
+                if len(in_flight)==0 and self._pool.used_elsewhere(self)==0 and self._holds==0 \
+                   and len(self._submissions)==0:
+                    # nothing running and nothing launchable, we would wait forever
+                    # (or nothing left at all, the last submissions were cancelled)
+                    if len(self._pending_tasks)!=0:
+                        print('Error : no task can be scheduled, pending tasks',
+                              list(self._pending_tasks.keys()))
+                    break
+
+                # sleep until something completes (or it is time for a status report,
+                # or tasks waiting for their data node should be reconsidered)
+                loop_time = time.perf_counter() - loop_start
+                ready, deferred = len(self._ready_queue), len(self._deferred_queue)
+                self._metrics.set_states(len(self._pending_tasks) - ready - deferred, ready, deferred,
+                                         len(self._cancelled_task_array))
+                timeout = report_interval
+                if self._locality_wait>0 and len(self._deferred_queue)!=0:
+                    timeout = min(timeout, self._locality_wait)
+                if len(self._retry_queue)!=0:
+                    timeout = min(timeout, max(0, self._retry_queue[0][0] - self._clock.time()))
+                done = self._clock.wait([wakeup, submitted], timeout)
+                loop_start = time.perf_counter()
+
+                # Clear every task that has completed
+                for future in done:
+                    # wakeup and submitted, or ones of earlier passes since renewed
+                    if future not in in_flight:
+                        continue
+                    completed_task_status = self.completed_task_status(in_flight.pop(future))
                     node = completed_task_status.task().node()
-                    print('Job {} Completed : node {}, cpus {}, GB {}'
-                          .format(completed_task_status.task().task_id(), node, self._cpu_avail[node], mem_gb(self._mem_avail[node])))
+                    outcome = completed_task_status.outcome()
+                    print('Job {} Completed : exit code {}, node {}, cpus {}, GB {}'
+                          .format(completed_task_status.task().task_id(), outcome[0], node, self._resources.cpu_avail(node), mem_gb(self._resources.mem_avail(node))))
 
+                    completed_task_status.task().set_peak_memory(completed_task_status.peak_memory())
+                    if completed_task_status.mem_available() is not None:
+                        self._pool.set_mem_available(node, completed_task_status.mem_available())
+                    self.record_task_history(completed_task_status)
+                    self._trace.finished(completed_task_status.task(), *outcome)
+                    self._metrics.finished(outcome[0], completed_task_status.launch_latency())
+                    if self._journal is not None:
+                        self._journal.finished(completed_task_status.task(), *outcome)
+                    if outcome[0]!=0 and self._cancel_requested:
+                        # killed by cancel_workflow
+                        self.cancel_task(completed_task_status.task(), outcome[0])
+                        continue
+                    if outcome[0]!=0:
+                        self.task_failed(completed_task_status.task(), outcome[0])
+                        continue
                     self._completed_task_array.append(
                         completed_task_status.task())
-                    self._task_status_array.remove(completed_task_status)
-                    # any more completed tasks?
-                    completed_task_status = self.completed_task_status()
+                    self._completed_ids.add(completed_task_status.task().task_id())
+                    self.record_data_location(completed_task_status.task())
+                    self.release_child_tasks(completed_task_status.task())
+                    self.post_event(completed_task_status.task(), 'completed', 0)
+                    self.run_callback(completed_task_status.task(), 0)
+
+                # resources were freed, tasks that did not fit may now do so
+                self.requeue_deferred_tasks()
+
+                self._metrics.loop_time(loop_time + time.perf_counter() - loop_start)
+                now = self._clock.time()
+                if (now-last_now>report_interval):
+                    print(self._metrics.summary_line())
+                    last_now = now
+        except BaseException:
+            # e.g. the notebook kernel was interrupted, do not leave tasks running
+            print('Workflow interrupted, killing', len(in_flight), 'running tasks')
+            for status in in_flight.values():
+                launcher.kill(status.task())
+            raise
+        finally:
+            with self._submit_lock:
+                self._running = False
+                self._cancel_requested = False
+                # submitted too late for this run, they will be part of the next
+                self._task_array += self._submissions
+                self._submissions = []
+            launcher.shutdown()
+            if hasattr(launcher, 'stats'):
+                self._launch_stats = launcher.stats()
+                print(splinter_launch.stats_line(self._launch_stats))
+            self._pool.detach(self)
+            self._metrics.shutdown()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if trace is not None:
+                self._trace.write_chrome(trace + '.json')
+                self._trace.write_csv(trace + '.csv')
+        if len(self._failed_task_array)!=0:
+            print('Workflow finished with', len(self._failed_task_array), 'failed tasks',
+                  [task.task_id() for task in self._failed_task_array], 'and',
+                  len(self._cancelled_task_array), 'cancelled tasks')
+        elif len(self._cancelled_task_array)!=0:
+            print('Workflow cancelled,', len(self._cancelled_task_array), 'tasks did not run to completion')
+        return (len(self._failed_task_array)==0 and len(self._cancelled_task_array)==0
+                and len(self._pending_tasks)==0)
+
+# -------------------------------------------------------------------
+# handle of a workflow executing in a background thread (see
+# splinter_workflow.start_workflow), so a notebook is not blocked while it
+# runs and can watch it, or start the next one while it drains
+class workflow_run:
+
+    def __init__(self, workflow, poll_frequency, srun, kwargs):
+        self._workflow = workflow
+        self._future   = concurrent.futures.Future()
+        self._events   = queue.Queue()
+        workflow._events = self._events
+        # running from now on, so that cancel() is not lost before the thread starts
+        with workflow._submit_lock:
+            workflow._running = True
+            workflow._cancel_requested = False
+        self._thread = threading.Thread(target=self._run, args=(poll_frequency, srun, kwargs),
+                                        name='splinter-run', daemon=True)
+        self._thread.start()
+
+    def _run(self, poll_frequency, srun, kwargs):
+        try:
+            self._future.set_result(self._workflow.execute_workflow(poll_frequency, srun, **kwargs))
+        except BaseException as exc:
+            self._future.set_exception(exc)
+        finally:
+            # end of the event stream, later runs of the workflow post no events here
+            self._workflow._events = None
+            self._events.put(None)
+
+    def workflow(self):
+        return self._workflow
+
+    # counts of tasks by state, see splinter_workflow.progress
+    def progress(self):
+        return self._workflow.progress()
+
+    def done(self):
+        return self._future.done()
+
+    # wait for the workflow to finish, returns False if it has not after timeout seconds
+    def wait(self, timeout=None):
+        concurrent.futures.wait([self._future], timeout=timeout)
+        return self._future.done()
 
-                time.sleep(poll_frequency)
-                poll_loop += 1
+    # what execute_workflow returned, True if every task completed
+    def result(self, timeout=None):
+        return self._future.result(timeout)
+
+    # kill the tasks in flight, launch nothing more
+    def cancel(self):
+        self._workflow.cancel_workflow()
+
+    # -------------------------------------------------------------------
+    # completion events as they happen, dicts with the task, its state
+    # ('completed', 'failed' or 'cancelled'), exit code and time, the
+    # iteration ends with the workflow
+    def events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                self._events.put(None)
+                return
+            yield event
+
+    # the events posted since the last call, without blocking
+    def poll_events(self):
+        events = []
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                return events
+            if event is None:
+                self._events.put(None)
+                return events
+            events.append(event)
+
+# -------------------------------------------------------------------
+# run several workflows at the same time, each from a thread of its own,
+# they should share a node_pool so that they divide the allocation between
+# them. The arguments are passed to every execute_workflow, returns the
+# list of their results
+def execute_workflows(workflows, poll_frequency, srun, **kwargs):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(workflows))) as executor:
+        futures = [executor.submit(workflow.execute_workflow, poll_frequency, srun, **kwargs)
+                   for workflow in workflows]
+        return [future.result() for future in futures]
 
 
 if __name__ == "__main__":
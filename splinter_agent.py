@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# splinter launch agent
+# One agent runs on each node for the lifetime of a workflow (started with a
+# single srun step per node, or directly on localhost). splinter streams task
+# commands to it on stdin and the agent starts them immediately, so a task
+# launch costs a pipe write instead of a new srun step.
+#
+# protocol : one JSON object per line
+#   request (stdin)   {"id": 7, "command": ["ls", "-1"],
+#                      "stdout": "/path/7.out", "stderr": "/path/7.err"}
+#   reply   (stdout)  {"id": 7, "returncode": 0, "pid": 1234,
+#                      "start": <epoch>, "end": <epoch>,
+#                      "peak_memory": <bytes>, "mem_available": <bytes>}
+# the output of a task is written to the stdout/stderr files of the request
+# (discarded when they are not given), never to the agent's own stdout.
+# a command that cannot be started replies with returncode -1 and "error".
+#   kill    (stdin)   {"kill": 7}   terminates task 7, which then replies as usual
+# When stdin is closed the agent waits for running tasks and exits.
+# usage : splinter_agent.py [memory_interval]
+# the memory of running tasks is sampled every memory_interval seconds (0,
+# the default, does not measure it), replies then carry the peak memory of
+# the task and the free memory of the node when it ended.
+
+import asyncio
+import json
+import signal
+import sys
+import time
+import splinter_memory
+
+# -------------------------------------------------------------------
+# write a reply line, replies from concurrent tasks must not interleave,
+# which is guaranteed because everything runs on the one event loop
+def reply(message):
+    sys.stdout.write(json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+def close_files(files):
+    for f in files:
+        if f!=asyncio.subprocess.DEVNULL:
+            f.close()
+
+# running processes, and the ids of tasks killed before they started
+processes = {}
+killed = set()
+# samples the memory of running tasks, None when it is not measured
+sampler = None
+
+def kill_task(request_id):
+    killed.add(request_id)
+    process = processes.get(request_id)
+    if process is not None and process.returncode is None:
+        process.terminate()
+
+# -------------------------------------------------------------------
+# run one task and report its exit status and timing
+async def run_task(request):
+    start = time.time()
+    if request['id'] in killed:
+        reply({'id': request['id'], 'returncode': -signal.SIGTERM, 'pid': 0,
+               'start': start, 'end': time.time()})
+        return
+    files = []
+    try:
+        for key in ('stdout', 'stderr'):
+            files.append(open(request[key], 'wb') if request.get(key) else asyncio.subprocess.DEVNULL)
+        process = await asyncio.create_subprocess_exec(*request['command'],
+                                                       stdin=asyncio.subprocess.DEVNULL,
+                                                       stdout=files[0], stderr=files[1])
+    except OSError as exc:
+        close_files(files)
+        reply({'id': request['id'], 'returncode': -1, 'pid': 0,
+               'start': start, 'end': time.time(), 'error': str(exc)})
+        return
+    processes[request['id']] = process
+    if sampler is not None:
+        sampler.add(request['id'], process.pid)
+    await process.wait()
+    del processes[request['id']]
+    close_files(files)
+    message = {'id': request['id'], 'returncode': process.returncode, 'pid': process.pid,
+               'start': start, 'end': time.time()}
+    if sampler is not None:
+        message['peak_memory']   = sampler.remove(request['id'])
+        message['mem_available'] = splinter_memory.mem_available()
+    reply(message)
+
+# -------------------------------------------------------------------
+# sample the memory of the running tasks from the event loop
+async def sample_memory():
+    while True:
+        await asyncio.sleep(sampler.interval())
+        sampler.sample()
+
+# -------------------------------------------------------------------
+# read requests until stdin closes
+async def serve():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2**24)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    running = set()
+    if sampler is not None:
+        asyncio.ensure_future(sample_memory())
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if 'kill' in request:
+            kill_task(request['kill'])
+            continue
+        task = asyncio.ensure_future(run_task(request))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    if running:
+        await asyncio.wait(running)
+
+
+if __name__ == "__main__":
+    if len(sys.argv)>1 and float(sys.argv[1])>0:
+        sampler = splinter_memory.peak_sampler(float(sys.argv[1]))
+    asyncio.run(serve())
@@ -0,0 +1,285 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Scalability benchmark of the splinter scheduler itself. Workflows shaped
+# like generate_demo_workflow of the CDO driver (a preprocess task forking
+# into chains of iterations that are joined by a final analyze task) are
+# run with launches that do nothing, either in process (the null launcher)
+# or by running `true` with one of the real launchers, so the time measured
+# is that of the scheduler.
+#
+# shapes, for a number of tasks n
+#   wide : n-2 forks of one iteration, a huge fan out and fan in
+#   deep : 2 forks of (n-2)/2 iterations, long dependency chains
+#   demo : sqrt(n) forks of sqrt(n) iterations
+#
+# each case runs in a process of its own so peak memory is its own, and
+# reports
+#   build            : seconds to create the tasks
+#   first_launch     : seconds from execute_workflow to the first launch
+#   total            : seconds of execute_workflow
+#   overhead_us      : total per task (microseconds)
+#   find_next_task_us, completed_task_status_us, release_child_tasks_us :
+#                      per task time spent in those scheduler methods
+#   init_dependencies: seconds to build the dependency graph
+#   peak_rss_mb      : peak memory of the driver process
+#   rss_per_task     : bytes of peak memory per task, over the baseline
+#
+# each case is run repeat times, in rounds over all the cases so that a
+# slow spell of the machine does not fall on every run of one case, and
+# the least of each measurement is kept : the least is what the code costs,
+# what is above it is noise from the machine.
+# Results are appended to a CSV (results/splinter-benchmark.csv by default,
+# loadable with maestro_plotutils.read_pandas_csv) and each case is compared
+# with the last earlier runs of the same case on the same host, overhead or
+# memory up by more than the tolerance over the worst of them is reported as
+# a regression (and the exit status is 1) : how far apart the earlier runs
+# are is how much the case varies on the machine, a regression has to go
+# beyond that. A case needs a few earlier runs before it is compared.
+#
+# usage : python splinter_benchmark.py [--sizes 100 1000 ...] [--shapes wide deep demo]
+#                                      [--launcher null] [--output path] [--tolerance 0.25]
+#                                      [--repeat 5]
+
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import math
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+import splinter
+import splinter_launch
+import splinter_simulate
+
+shapes = ('wide', 'deep', 'demo')
+
+default_output = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'splinter-benchmark.csv')
+
+# -------------------------------------------------------------------
+# forks and iterations of a shape with about num_tasks tasks
+def shape_size(shape, num_tasks):
+    n = max(2, num_tasks - 2)
+    if shape=='wide':
+        return n, 1
+    elif shape=='deep':
+        return 2, max(1, n//2)
+    elif shape=='demo':
+        side = max(1, math.isqrt(n))
+        return side, side
+    raise ValueError('Unknown benchmark shape ' + str(shape))
+
+# -------------------------------------------------------------------
+# the tasks of generate_demo_workflow for forks x iterations, preprocess
+# and analyze on 4 cores and the iterations on 5, as in the CDO driver.
+# Each task reads the output of the one before it in its chain
+def demo_tasks(forks, iterations, data_size=65536, cores=(4, 5, 4), memory=2**30):
+    ids = ('ID{:07d}'.format(i) for i in itertools.count(1))
+    tasks = []
+    preprocess = next(ids)
+    outputs = {'f-{:02d}-00'.format(f): data_size for f in range(forks)}
+    tasks.append(splinter.task(preprocess, ['true', '-c', preprocess], [], cores[0], memory,
+                               name='process-CDO', outputs=outputs))
+    last = [(preprocess, 'f-{:02d}-00'.format(f)) for f in range(forks)]
+    for i in range(iterations):
+        for f in range(forks):
+            task_id = next(ids)
+            parent, in_name = last[f]
+            out_name = 'f-{:02d}-{:02d}'.format(f, i + 1)
+            tasks.append(splinter.task(task_id, ['true', '-c', task_id, '-i', in_name, '-o', out_name], [parent],
+                                       cores[1], memory, name='process-CDO',
+                                       inputs={in_name: data_size}, outputs={out_name: data_size}))
+            last[f] = (task_id, out_name)
+    analyze = next(ids)
+    tasks.append(splinter.task(analyze, ['true', '-c', analyze], [task_id for task_id, name in last], cores[2],
+                               memory, name='process-CDO', inputs={name: data_size for task_id, name in last}))
+    return tasks
+
+# -------------------------------------------------------------------
+# wraps a method to count its calls and the time spent in them
+class call_timer:
+
+    def __init__(self, function):
+        self._function = function
+        self.calls   = 0
+        self.seconds = 0.0
+        self.first   = None
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        if self.first is None:
+            self.first = start
+        try:
+            return self._function(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.calls += 1
+
+# -------------------------------------------------------------------
+# peak memory of this process in bytes
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+# -------------------------------------------------------------------
+# run one case in this process, returns its measurements
+def run_case(shape, num_tasks, launcher_name, nodes=8, cpus=128):
+    baseline = peak_rss()
+    forks, iterations = shape_size(shape, num_tasks)
+    devnull = open(os.devnull, 'w')
+    with contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        tasks = demo_tasks(forks, iterations)
+        build = time.perf_counter() - start
+        node_list = splinter_simulate.synthetic_nodes(nodes, cpus, 512*2**30)
+        workflow = splinter.splinter_workflow(pool=splinter.node_pool(nodes=node_list, cpu_binding=False),
+                                              memory_interval=0)
+        for new_task in tasks:
+            workflow.add_task(new_task)
+        timers = {}
+        for name in ('find_next_task', 'completed_task_status', 'release_child_tasks', 'init_dependencies'):
+            timers[name] = call_timer(getattr(workflow, name))
+            setattr(workflow, name, timers[name])
+        launcher = splinter_launch.make_launcher(launcher_name, nodes*cpus, False, 0, node_list)
+        launch = call_timer(launcher.launch)
+        launcher.launch = launch
+        start = time.perf_counter()
+        ok = workflow.execute_workflow(0, False, launcher=launcher, log_dir=os.devnull)
+        total = time.perf_counter() - start
+    if not ok:
+        raise RuntimeError('benchmark workflow did not complete')
+    n = len(tasks)
+    peak = peak_rss()
+    return {'shape': shape, 'tasks': n, 'forks': forks, 'iterations': iterations, 'launcher': launcher_name,
+            'build': build, 'first_launch': launch.first - start, 'total': total,
+            'overhead_us': total/n*1e6,
+            'find_next_task_us': timers['find_next_task'].seconds/n*1e6,
+            'completed_task_status_us': timers['completed_task_status'].seconds/n*1e6,
+            'release_child_tasks_us': timers['release_child_tasks'].seconds/n*1e6,
+            'init_dependencies': timers['init_dependencies'].seconds,
+            'peak_rss_mb': peak/2**20, 'rss_per_task': (peak - baseline)/n}
+
+# -------------------------------------------------------------------
+# run a case in a new python process (so it starts with a clean heap)
+def run_case_process(shape, num_tasks, launcher_name):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', shape, str(num_tasks), launcher_name],
+                            stdout=subprocess.PIPE, encoding='utf-8', check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+# the measurements of a case, of which the least of the repeats is kept
+measurements = ('build', 'first_launch', 'total', 'overhead_us', 'find_next_task_us', 'completed_task_status_us',
+                'release_child_tasks_us', 'init_dependencies', 'peak_rss_mb', 'rss_per_task')
+
+# -------------------------------------------------------------------
+# the runs of a case as one result, the least of each measurement
+def least(runs):
+    result = dict(runs[0])
+    for name in measurements:
+        result[name] = min([run[name] for run in runs])
+    return result
+
+# -------------------------------------------------------------------
+# what identifies the code and machine a result was measured on
+def run_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8').stdout.strip()
+    except OSError:
+        commit = ''
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'host': socket.gethostname(),
+            'python': platform.python_version()}
+
+columns = ['time', 'commit', 'host', 'python', 'shape', 'tasks', 'forks', 'iterations', 'launcher',
+           'build', 'first_launch', 'total', 'overhead_us', 'find_next_task_us', 'completed_task_status_us',
+           'release_child_tasks_us', 'init_dependencies', 'peak_rss_mb', 'rss_per_task']
+
+def read_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+def append_results(path, rows):
+    new_file = not os.path.exists(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        if new_file:
+            writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+# -------------------------------------------------------------------
+# metrics of a result more than tolerance above the worst of the last
+# earlier results of the same case on the same host, as (metric, value,
+# worst). Nothing is compared with fewer than min_runs earlier results,
+# how much the case varies is not known yet
+regression_metrics = ('overhead_us', 'find_next_task_us', 'completed_task_status_us',
+                      'release_child_tasks_us', 'rss_per_task')
+
+def regressions(result, history, tolerance, last=5, min_runs=3):
+    same = [row for row in history if row['host']==result['host'] and row['shape']==result['shape']
+            and int(row['tasks'])==result['tasks'] and row['launcher']==result['launcher']][-last:]
+    found = []
+    if len(same)<min_runs:
+        return found
+    for metric in regression_metrics:
+        if metric=='rss_per_task' and result['tasks']<10000:
+            # the interpreter itself dominates small runs
+            continue
+        worst = max([float(row[metric]) for row in same])
+        # microsecond level timings are noise below a floor
+        floor = 1.0 if metric.endswith('_us') else 0
+        if result[metric]>max(worst, floor)*(1 + tolerance):
+            found.append((metric, result[metric], worst))
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='splinter scheduler scalability benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                        help='numbers of tasks (up to 1000000)')
+    parser.add_argument('--shapes', nargs='+', default=list(shapes), choices=shapes)
+    parser.add_argument('--launcher', default='null', choices=splinter_launch.launchers,
+                        help='null runs nothing, the others run true')
+    parser.add_argument('--output', default=default_output, help='CSV file results are appended to')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative increase over the worst of the earlier runs reported as a regression')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each case, the least is kept')
+    parser.add_argument('--case', nargs=3, metavar=('SHAPE', 'TASKS', 'LAUNCHER'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]), args.case[2])))
+        sys.exit(0)
+
+    history = read_results(args.output)
+    info = run_info()
+    cases = [(shape, num_tasks) for num_tasks in args.sizes for shape in args.shapes]
+    runs = {case: [] for case in cases}
+    for i in range(max(1, args.repeat)):
+        for shape, num_tasks in cases:
+            runs[(shape, num_tasks)].append(run_case_process(shape, num_tasks, args.launcher))
+    results = []
+    failed = []
+    print('{:6} {:>8} {:>9} {:>9} {:>11} {:>9} {:>9} {:>9} {:>9}'.format(
+        'shape', 'tasks', 'build s', '1st s', 'us/task', 'find us', 'done us', 'deps us', 'peak MB'))
+    for case in cases:
+        result = dict(info)
+        result.update(least(runs[case]))
+        results.append(result)
+        print('{:6} {:>8} {:>9.3f} {:>9.3f} {:>11.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.0f}'.format(
+            result['shape'], result['tasks'], result['build'], result['first_launch'], result['overhead_us'],
+            result['find_next_task_us'], result['completed_task_status_us'],
+            result['release_child_tasks_us'], result['peak_rss_mb']))
+        for metric, value, worst in regressions(result, history, args.tolerance):
+            print('  REGRESSION {} {:.2f} (worst of earlier runs {:.2f})'.format(metric, value, worst))
+            failed.append((result['shape'], result['tasks'], metric))
+    append_results(args.output, results)
+    print('Results appended to', args.output)
+    sys.exit(1 if len(failed)!=0 else 0)
@@ -0,0 +1,143 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Persistent record of completed splinter tasks, kept in an SQLite
+# database (by default under $SCRATCH) so that every run adds to what is
+# known about each transformation. The scheduler, the graph display and the
+# sweep driver use it to predict how long a task will take and how much
+# memory it needs, instead of relying on hand written metadata.
+
+import sqlite3
+import os
+import time
+import math
+
+# -------------------------------------------------------------------
+# default database location, under the scratch dir when there is one
+def default_history_path():
+    return os.path.join(os.getenv('SCRATCH', os.getcwd()), 'splinter-history.sqlite')
+
+# -------------------------------------------------------------------
+# value following the '-d' option of a command, the data size in bytes
+# used by process-CDO and friends, or None if there is no '-d'
+def argument_data_size(args):
+    args = [str(a) for a in args]
+    for i, arg in enumerate(args[:-1]):
+        if arg=='-d':
+            try:
+                return int(float(args[i+1]))
+            except ValueError:
+                return None
+    return None
+
+# -------------------------------------------------------------------
+# a signature of the arguments of a command, the options it was given
+# (file names, component ids and the like are left out so that tasks
+# doing the same kind of work share a signature)
+def argument_signature(args):
+    args = [str(a) for a in args]
+    options = [a for a in args if a.startswith('-') and not a.lstrip('-').replace('.','',1).isdigit()]
+    signature = ' '.join(options)
+    data_size = argument_data_size(args)
+    if data_size is not None:
+        signature += ' d=' + str(data_size)
+    return signature
+
+# -------------------------------------------------------------------
+# nearest rank percentile of a list of values
+def percentile(values, p):
+    if len(values)==0:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values)-1, math.ceil(p/100.0*len(values)) - 1))
+    return values[rank]
+
+# -------------------------------------------------------------------
+# the history database
+class task_history:
+
+    def __init__(self, path=None):
+        self._path = path if path is not None else default_history_path()
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS task_runs (
+                              transformation TEXT,
+                              signature      TEXT,
+                              data_size      INTEGER,
+                              node           TEXT,
+                              cores          INTEGER,
+                              memory         INTEGER,
+                              peak_memory    INTEGER,
+                              wall_time      REAL,
+                              exit_code      INTEGER,
+                              finished       REAL)''')
+        self._db.execute('''CREATE INDEX IF NOT EXISTS task_runs_by_name
+                              ON task_runs (transformation, data_size)''')
+        self._db.commit()
+
+    def path(self):
+        return self._path
+
+    # -------------------------------------------------------------------
+    # store one completed task, args are the arguments after the executable
+    def record(self, transformation, args, node, cores, memory, wall_time, exit_code, peak_memory=None):
+        self._db.execute('INSERT INTO task_runs VALUES (?,?,?,?,?,?,?,?,?,?)',
+                         (transformation, argument_signature(args), argument_data_size(args),
+                          node, cores, memory, peak_memory, wall_time, exit_code, time.time()))
+        self._db.commit()
+
+    # -------------------------------------------------------------------
+    # values of a column for the successful runs of a transformation,
+    # restricted to the given data size when there are runs with that size
+    def _successful(self, column, transformation, data_size):
+        query = 'SELECT ' + column + ' FROM task_runs WHERE transformation=? AND exit_code=0 AND ' + column + ' IS NOT NULL'
+        if data_size is not None:
+            rows = self._db.execute(query + ' AND data_size=?', (transformation, data_size)).fetchall()
+            if len(rows)!=0:
+                return [row[0] for row in rows]
+        rows = self._db.execute(query, (transformation,)).fetchall()
+        return [row[0] for row in rows]
+
+    # -------------------------------------------------------------------
+    # predicted wall time (seconds) of a transformation at the given
+    # percentile, e.g. 50 for the median or 95, None if never seen
+    def predict_duration(self, transformation, data_size=None, p=50):
+        return percentile(self._successful('wall_time', transformation, data_size), p)
+
+    # -------------------------------------------------------------------
+    # predicted peak memory (bytes), None if it has been measured fewer
+    # than min_runs times
+    def predict_memory(self, transformation, data_size=None, p=95, min_runs=1):
+        values = self._successful('peak_memory', transformation, data_size)
+        if len(values)<max(1, min_runs):
+            return None
+        return int(percentile(values, p))
+
+    # -------------------------------------------------------------------
+    # summary per transformation and data size : runs, median and p95 time,
+    # p95 of the measured peak memory
+    def summary(self):
+        rows = self._db.execute('''SELECT DISTINCT transformation, data_size FROM task_runs
+                                   ORDER BY transformation, data_size''').fetchall()
+        result = []
+        for transformation, data_size in rows:
+            times = [row[0] for row in self._db.execute(
+                '''SELECT wall_time FROM task_runs WHERE transformation=? AND data_size IS ?
+                   AND exit_code=0''', (transformation, data_size)).fetchall()]
+            peaks = [row[0] for row in self._db.execute(
+                '''SELECT peak_memory FROM task_runs WHERE transformation=? AND data_size IS ?
+                   AND exit_code=0 AND peak_memory IS NOT NULL''', (transformation, data_size)).fetchall()]
+            result.append((transformation, data_size, len(times),
+                           percentile(times, 50), percentile(times, 95), percentile(peaks, 95)))
+        return result
+
+    def close(self):
+        self._db.close()
+
+
+if __name__ == "__main__":
+    import sys
+    history = task_history(sys.argv[1] if len(sys.argv)>1 else None)
+    print('History', history.path())
+    for transformation, data_size, runs, p50, p95, peak in history.summary():
+        print('{:24} size {:>12} runs {:>6} p50 {} p95 {} peak memory p95 {}'.format(
+            transformation, str(data_size), runs, p50, p95, peak))
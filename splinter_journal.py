@@ -0,0 +1,107 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Write-ahead journal of a splinter workflow run. Every change of state of
+# a task (submitted, completed, failed) is appended to a JSON lines file
+# and flushed before the scheduler carries on, so when the driver crashes
+# or the allocation times out the journal tells which tasks have already
+# finished, and execute_workflow(journal=..., resume=True) only runs the rest.
+#
+# one record per line
+#   {"event":"workflow","time":<epoch>,"tasks":120,"resumed":3}
+#   {"event":"submitted","id":"ID0000007","node":"nid00012","cpus":[0,1],"time":<epoch>}
+#   {"event":"completed","id":"ID0000007","node":"nid00012","rc":0,
+#    "start":<epoch>,"end":<epoch>,"cmd":<crc32 of the command line>,
+#    "peak":<peak memory in bytes, or null>}
+# "failed" records are the same as "completed" with a non zero rc.
+
+import json
+import os
+import time
+import zlib
+
+# -------------------------------------------------------------------
+# a checksum of a command line, a journaled task whose command has
+# changed since it ran is not considered done when resuming
+def command_signature(command):
+    return zlib.crc32('\0'.join([str(a) for a in command]).encode('utf-8'))
+
+# -------------------------------------------------------------------
+# the journal being written, resume appends to an existing journal,
+# otherwise any previous journal at path is replaced.
+# sync forces completion records to disk (fsync), submissions are only flushed
+class task_journal:
+
+    def __init__(self, path, resume=False, sync=True):
+        self._path = path
+        self._sync = sync
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def path(self):
+        return self._path
+
+    def _write(self, record, sync=False):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    # -------------------------------------------------------------------
+    # start of a run, resumed is the number of tasks taken from the journal
+    def start(self, num_tasks, resumed=0):
+        self._write({'event': 'workflow', 'time': time.time(), 'tasks': num_tasks, 'resumed': resumed})
+
+    def submitted(self, task):
+        self._write({'event': 'submitted', 'id': task.task_id(), 'node': task.node(),
+                     'cpus': task.cpus(), 'time': time.time()})
+
+    # -------------------------------------------------------------------
+    # a task has finished, with its exit code and where/when it ran
+    def finished(self, task, returncode, start_time, end_time):
+        event = 'completed' if returncode==0 else 'failed'
+        self._write({'event': event, 'id': task.task_id(), 'node': task.node(), 'rc': returncode,
+                     'start': start_time, 'end': end_time,
+                     'cmd': command_signature(task.command()), 'peak': task.peak_memory()}, self._sync)
+
+    def close(self):
+        self._file.close()
+
+# -------------------------------------------------------------------
+# the last record of every task in a journal, by task id.
+# A line cut short by a crash is ignored
+def replay(path):
+    last = {}
+    if not os.path.exists(path):
+        return last
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'id' in record:
+                last[record['id']] = record
+    return last
+
+# -------------------------------------------------------------------
+# journal records of the tasks (a dict of task id to task) that completed
+# successfully with the command they still have, these need not run again
+def completed_tasks(path, tasks):
+    completed = {}
+    for task_id, record in replay(path).items():
+        if record['event']!='completed' or task_id not in tasks:
+            continue
+        if record.get('cmd')!=command_signature(tasks[task_id].command()):
+            print('Task', task_id, 'command has changed since it was journaled, it will run again')
+            continue
+        completed[task_id] = record
+    return completed
+
+
+if __name__ == "__main__":
+    import sys
+    states = {}
+    for task_id, record in replay(sys.argv[1]).items():
+        states.setdefault(record['event'], []).append(task_id)
+    for event, ids in states.items():
+        print('{:10} {}'.format(event, len(ids)))
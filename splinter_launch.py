@@ -0,0 +1,714 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Launchers used by splinter to start the command of a task.
+# Every launcher has the operations of the launcher class below
+#   prepare(nodes)     : once, before the first launch (e.g. open connections)
+#   launch(task, logs) : start a task, returns a concurrent.futures.Future
+#                        that completes with a subprocess.CompletedProcess
+#                        when the command exits, polled (done()) and awaited
+#                        by the scheduler, which only ever waits on these
+#   kill(task)         : terminate a launched task (with srun the step is
+#                        cancelled), its future then completes with the exit
+#                        status of the killed command
+#   stats()            : counts and latencies of the launches so far
+#   shutdown()         : once, when the workflow is done
+# so launchers can be swapped, and new ones compared, without touching the
+# scheduler.
+# The output of a task never passes through python, stdout and stderr go
+# straight to the log files given with the task (see task_log_paths) or
+# are discarded.
+# When memory_interval is set, launchers also report the peak memory of
+# each task and the free memory left on its node (see splinter_memory), for
+# tasks run in srun steps only with sacct_memory, as the peak then comes from
+# sacct and the task is not complete until the accounting record is found.
+
+import subprocess
+import concurrent.futures
+import threading
+import asyncio
+import sys
+import os
+import json
+import time
+import itertools
+import signal
+import shlex
+import shutil
+import tempfile
+import splinter_topology
+import splinter_memory
+import splinter_metrics
+
+# -------------------------------------------------------------------
+# srun options used to run a single task inside our allocation on a given node
+# when cpus (OS cpu indices) are given the step is bound to exactly those,
+# name is the step name, used to find the step in the accounting records
+def srun_command(job_id, host, command, cpus=None, name=None):
+    if cpus:
+        binding = f'-c {len(cpus)} --cpu-bind=mask_cpu:{splinter_topology.cpu_mask(cpus)}'
+    else:
+        binding = '-c 1'
+    commands = f'srun --jobid={job_id} -w {host} -u -N 1 -n 1 {binding} --mem-per-cpu=0 --overcommit --overlap'
+    if name is not None:
+        commands += f' -J {name}'
+    return commands.split(' ') + command
+
+# -------------------------------------------------------------------
+# multiplexed ssh connections, the first ssh to a host becomes the master
+# of a ControlMaster socket and later sessions reuse it, so connecting
+# again costs no handshake. close() shuts down the masters that were used
+class ssh_pool:
+
+    def __init__(self, control_dir=None, persist=60):
+        if control_dir is None:
+            control_dir = os.path.join(os.getenv('XDG_RUNTIME_DIR', '/tmp'), 'splinter-ssh-' + str(os.getuid()))
+        os.makedirs(control_dir, mode=0o700, exist_ok=True)
+        self._control_dir = control_dir
+        self._persist = persist
+        self._lock    = threading.Lock()
+        self._hosts   = set()
+
+    def options(self):
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=' + os.path.join(self._control_dir, '%r@%h:%p'),
+                '-o', 'ControlPersist=' + str(self._persist)]
+
+    # the ssh command line running command (a string or list) on host
+    def command(self, host, command):
+        with self._lock:
+            self._hosts.add(host)
+        if not isinstance(command, str):
+            command = ' '.join(command)
+        return ['ssh', '-T'] + self.options() + [host, command]
+
+    # start the masters of all hosts at once, so that the first commands do
+    # not each wait for a handshake
+    def connect(self, hosts, max_sessions=32):
+        hosts = sorted(set(hosts))
+        if len(hosts)==0:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(hosts), max_sessions)) as executor:
+            futures = {executor.submit(subprocess.run, self.command(host, 'true'), stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL): host for host in hosts}
+            for future in concurrent.futures.as_completed(futures):
+                if future.result().returncode!=0:
+                    print('Warning, could not connect to', futures[future], 'with ssh')
+
+    # terminate the processes on host with marker in their environment (see
+    # ssh_command), in the background as nothing waits for it
+    def kill(self, host, marker):
+        script = ('for p in /proc/[0-9]*; do grep -qxz ' + shlex.quote('SPLINTER_STEP=' + marker)
+                  + ' $p/environ 2>/dev/null && kill -TERM ${p#/proc/}; done')
+        threading.Thread(target=subprocess.run, args=(self.command(host, script),),
+                         kwargs={'stdin': subprocess.DEVNULL, 'stdout': subprocess.DEVNULL,
+                                 'stderr': subprocess.DEVNULL}, daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            hosts = list(self._hosts)
+            self._hosts.clear()
+        for host in hosts:
+            subprocess.run(['ssh'] + self.options() + ['-O', 'exit', host],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# -------------------------------------------------------------------
+# a command run directly on its node, bound to the task's cpus with taskset
+def bound_command(task):
+    if task.cpus():
+        return ['taskset', '-c', ','.join([str(cpu) for cpu in task.cpus()])] + task.command()
+    return task.command()
+
+# -------------------------------------------------------------------
+# the result of a task, a CompletedProcess that may also carry the
+# start/end time (epoch seconds) measured where the task actually ran (for
+# a process started by the launcher, when it was spawned and reaped, with
+# srun or ssh that of the srun or ssh process),
+# its peak memory and the free memory of its node when it ended (bytes)
+class task_result(subprocess.CompletedProcess):
+    def __init__(self, args, returncode, stdout=None, stderr=None, start_time=None, end_time=None,
+                 peak_memory=None, mem_available=None):
+        super().__init__(args, returncode, stdout, stderr)
+        self.start_time = start_time
+        self.end_time   = end_time
+        self.peak_memory   = peak_memory
+        self.mem_available = mem_available
+
+# -------------------------------------------------------------------
+# (stdout, stderr) log files of a task in the log directory of a run,
+# None when output is discarded (log_dir is None or os.devnull),
+# retries (attempt 1, 2 ...) get files of their own
+def task_log_paths(log_dir, task, attempt=0):
+    if log_dir is None or log_dir==os.devnull:
+        return None
+    name = str(task.task_id()).replace(os.sep, '_')
+    if attempt>0:
+        name += '.retry' + str(attempt)
+    return (os.path.join(log_dir, name + '.out'), os.path.join(log_dir, name + '.err'))
+
+# -------------------------------------------------------------------
+# open the log files of a task for writing, DEVNULL when there are none
+def open_logs(logs):
+    if logs is None:
+        return subprocess.DEVNULL, subprocess.DEVNULL
+    return open(logs[0], 'wb'), open(logs[1], 'wb')
+
+def close_logs(files):
+    for f in files:
+        if f!=subprocess.DEVNULL:
+            f.close()
+
+# -------------------------------------------------------------------
+# the srun step name of a task
+def step_name(task):
+    return 'splinter-' + str(task.task_id())
+
+# -------------------------------------------------------------------
+# how the process of a task reaches the node of the task
+#   local : run here, bound with taskset (the node of the task is ignored)
+#   srun  : an srun step of its own on the node, inside the allocation
+#   ssh   : over a multiplexed ssh connection to the node (see ssh_pool)
+transports = ('local', 'srun', 'ssh')
+
+# -------------------------------------------------------------------
+# marker put in the environment of a task run over ssh, so that it (and
+# whatever it starts) can be found on the node to kill it
+def ssh_marker(task):
+    return step_name(task) + '.' + str(os.getpid())
+
+# the ssh command running a task on its node, in the current directory
+# (the environment is that of a login on the node)
+def ssh_command(task, pool):
+    command = ['env', 'SPLINTER_STEP=' + ssh_marker(task)] + bound_command(task)
+    return pool.command(task.node(), 'cd ' + shlex.quote(os.getcwd()) + ' && exec ' + shlex.join(command))
+
+# -------------------------------------------------------------------
+# a command that first writes the id of the srun step it runs in to path,
+# which is how the step is found in the accounting records (sacct cannot
+# select the steps of a job by name)
+def step_id_command(path, command):
+    return ['sh', '-c', 'echo "$SLURM_STEP_ID" >"$0"; exec "$@"', path] + list(command)
+
+# -------------------------------------------------------------------
+# the command line that will be executed for a task with a transport,
+# pool is the ssh_pool of the ssh transport, with step_file an srun step
+# writes its id there (see step_id_command)
+def task_command(task, transport, job_id, pool=None, step_file=None):
+    if transport=='srun':
+        command = task.command() if step_file is None else step_id_command(step_file, task.command())
+        commands = srun_command(job_id, task.node(), command, task.cpus(), step_name(task))
+        print('SLURM executing', ' '.join(commands))
+        return commands
+    elif transport=='ssh':
+        return ssh_command(task, pool)
+    return bound_command(task)
+
+# -------------------------------------------------------------------
+# peak memory sampler of the tasks a launcher runs itself (locally),
+# None when memory is not measured
+def local_sampler(transport, memory_interval):
+    if transport!='local' or not memory_interval:
+        return None
+    sampler = splinter_memory.peak_sampler(memory_interval)
+    sampler.start()
+    return sampler
+
+# -------------------------------------------------------------------
+# counts and latencies of the launches of a launcher, updated from any
+# thread (futures complete on the threads of the launcher).
+# call is the time spent in launch() itself, what a launch costs the
+# scheduler loop, latency is from launch() until the task started, known
+# when the launcher reports where the task actually started (agent, null)
+class launch_stats:
+
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._launched = 0
+        self._completed = 0
+        self._failed   = 0
+        self._errors   = 0
+        self._killed   = 0
+        self._call     = splinter_metrics.histogram(splinter_metrics.loop_buckets)
+        self._latency  = splinter_metrics.histogram(splinter_metrics.latency_buckets)
+
+    def launched(self, call_seconds):
+        with self._lock:
+            self._launched += 1
+            self._call.observe(call_seconds)
+
+    def finished(self, future, submit_time):
+        with self._lock:
+            if future.exception() is not None:
+                self._errors += 1
+                return
+            result = future.result()
+            if result.returncode==0:
+                self._completed += 1
+            else:
+                self._failed += 1
+            start_time = getattr(result, 'start_time', None)
+            if start_time is not None:
+                self._latency.observe(max(0, start_time - submit_time))
+
+    def killed(self):
+        with self._lock:
+            self._killed += 1
+
+    # quantiles are upper bounds of histogram buckets (seconds), None when
+    # nothing was measured
+    def summary(self):
+        with self._lock:
+            done = self._completed + self._failed + self._errors
+            return {'launched': self._launched, 'completed': self._completed, 'failed': self._failed,
+                    'errors': self._errors, 'killed': self._killed, 'in_flight': self._launched - done,
+                    'call_p50': self._call.quantile(0.5), 'call_p95': self._call.quantile(0.95),
+                    'latency_p50': self._latency.quantile(0.5), 'latency_p95': self._latency.quantile(0.95),
+                    'latency_p99': self._latency.quantile(0.99)}
+
+# -------------------------------------------------------------------
+# one line report of the stats() of a launcher
+def stats_line(stats):
+    line = 'Launches {} completed {} failed {} errors {} killed {}'.format(
+        stats['launched'], stats['completed'], stats['failed'], stats['errors'], stats['killed'])
+    if stats['call_p95'] is not None:
+        line += ' launch call p50 <{}s p95 <{}s'.format(stats['call_p50'], stats['call_p95'])
+    if stats['latency_p95'] is not None:
+        line += ' start latency p50 <{}s p95 <{}s p99 <{}s'.format(
+            stats['latency_p50'], stats['latency_p95'], stats['latency_p99'])
+    return line
+
+# -------------------------------------------------------------------
+# the launcher interface (see the top of this file), a new launcher
+# implements _launch and _kill, the statistics are kept here
+class launcher:
+
+    def __init__(self):
+        self._stats = launch_stats()
+
+    # nodes is a dict of node name to (cores, memory) as in the resource pool
+    def prepare(self, nodes):
+        pass
+
+    # logs is the (stdout, stderr) pair from task_log_paths, or None
+    def launch(self, task, logs=None):
+        start = time.perf_counter()
+        submit_time = time.time()
+        future = self._launch(task, logs)
+        self._stats.launched(time.perf_counter() - start)
+        future.add_done_callback(lambda f: self._stats.finished(f, submit_time))
+        return future
+
+    def _launch(self, task, logs):
+        raise NotImplementedError
+
+    def kill(self, task):
+        self._stats.killed()
+        self._kill(task)
+
+    def _kill(self, task):
+        pass
+
+    def stats(self):
+        return self._stats.summary()
+
+    def shutdown(self):
+        pass
+
+# -------------------------------------------------------------------
+# base of the launchers starting a process per task, that reaches the node
+# of the task through a transport (see transports)
+class process_launcher(launcher):
+
+    def __init__(self, transport='local', job_id=0, memory_interval=None, sacct_memory=False):
+        super().__init__()
+        if transport not in transports:
+            raise ValueError('Unknown transport ' + str(transport))
+        self._transport = transport
+        self._job_id    = job_id
+        self._memory_interval = memory_interval
+        self._sacct_memory = sacct_memory and transport=='srun'
+        self._sampler = local_sampler(transport, memory_interval)
+        self._ssh = ssh_pool() if transport=='ssh' else None
+        # where srun steps write their ids, in the current directory as the
+        # steps run on the nodes
+        self._step_dir = None
+        if self._sacct_memory:
+            self._step_dir = tempfile.mkdtemp(prefix='.splinter-steps-', dir=os.getcwd())
+
+    def command(self, task):
+        step_file = os.path.join(self._step_dir, step_name(task)) if self._step_dir is not None else None
+        return task_command(task, self._transport, self._job_id, self._ssh, step_file)
+
+    # peak memory of the srun step named step from sacct, None when the
+    # step did not write its id
+    def sacct_peak_memory(self, step):
+        path = os.path.join(self._step_dir, step)
+        try:
+            with open(path) as f:
+                step_id = f.read().strip()
+            os.remove(path)
+        except OSError:
+            return None
+        if step_id=='':
+            return None
+        return splinter_memory.sacct_peak_memory(self._job_id, step_id)
+
+    # with ssh, connect to all the nodes up front
+    def prepare(self, nodes):
+        if self._ssh is not None:
+            self._ssh.connect(nodes)
+
+    # the process of a task run over ssh is only the local end, the task
+    # itself is killed on its node
+    def kill_remote(self, task):
+        if self._ssh is not None:
+            self._ssh.kill(task.node(), ssh_marker(task))
+
+    def shutdown(self):
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._ssh is not None:
+            self._ssh.close()
+        if self._step_dir is not None:
+            shutil.rmtree(self._step_dir, ignore_errors=True)
+
+# -------------------------------------------------------------------
+# launcher using one thread per running task, each blocked waiting for its process
+class thread_launcher(process_launcher):
+
+    def __init__(self, max_jobs, transport='local', job_id=0, memory_interval=None, sacct_memory=False):
+        super().__init__(transport, job_id, memory_interval, sacct_memory)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_jobs))
+        # running processes and tasks to kill, by task id
+        self._lock      = threading.Lock()
+        self._processes = {}
+        self._killed    = set()
+
+    # run a command to completion with its output going to its log files
+    def _run(self, task_id, command, logs, step):
+        files = open_logs(logs)
+        try:
+            with self._lock:
+                if task_id in self._killed:
+                    return subprocess.CompletedProcess(command, -signal.SIGTERM)
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=files[0], stderr=files[1])
+                self._processes[task_id] = process
+            start_time = time.time()
+            if self._sampler is not None:
+                self._sampler.add(task_id, process.pid)
+            process.wait()
+            end_time = time.time()
+        finally:
+            with self._lock:
+                self._processes.pop(task_id, None)
+            close_logs(files)
+        if self._sampler is not None:
+            return task_result(command, process.returncode, start_time=start_time, end_time=end_time,
+                               peak_memory=self._sampler.remove(task_id),
+                               mem_available=splinter_memory.mem_available())
+        if self._sacct_memory:
+            return task_result(command, process.returncode, start_time=start_time, end_time=end_time,
+                               peak_memory=self.sacct_peak_memory(step))
+        return task_result(command, process.returncode, start_time=start_time, end_time=end_time)
+
+    def _launch(self, task, logs):
+        return self._executor.submit(self._run, task.task_id(), self.command(task), logs, step_name(task))
+
+    def _kill(self, task):
+        self.kill_remote(task)
+        with self._lock:
+            self._killed.add(task.task_id())
+            process = self._processes.get(task.task_id())
+            if process is not None and process.poll() is None:
+                process.terminate()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        super().shutdown()
+
+# -------------------------------------------------------------------
+# make sure child processes are reaped by the event loop itself using
+# pidfds, rather than by the default watcher which starts a thread per child.
+# From python 3.12 the loop uses pidfds on its own when the kernel has them
+def install_child_watcher(loop):
+    if sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+        return
+    try:
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+    except OSError as exc:
+        # pidfd_open exists but the kernel does not support it
+        print('Warning, pidfd child watcher unavailable :', exc)
+
+# -------------------------------------------------------------------
+# the event loop used by asyncio launchers, running in a background thread.
+# Before python 3.12 the child watcher is process wide and tied to a single
+# loop, so all the launchers of a process (workflows running at the same
+# time) share one loop, started by the first and stopped by the last
+class event_loop_thread:
+    _lock    = threading.Lock()
+    _loop    = None
+    _thread  = None
+    _users   = 0
+
+    @classmethod
+    def acquire(cls):
+        with cls._lock:
+            if cls._users==0:
+                cls._loop = asyncio.new_event_loop()
+                install_child_watcher(cls._loop)
+                cls._thread = threading.Thread(target=cls._run_loop, args=(cls._loop,),
+                                               name='splinter-asyncio', daemon=True)
+                cls._thread.start()
+            cls._users += 1
+            return cls._loop
+
+    @classmethod
+    def release(cls):
+        with cls._lock:
+            cls._users -= 1
+            if cls._users==0:
+                cls._loop.call_soon_threadsafe(cls._loop.stop)
+                cls._thread.join()
+                cls._loop.close()
+                cls._loop = None
+
+    @staticmethod
+    def _run_loop(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+# -------------------------------------------------------------------
+# launcher that drives every running task from a single asyncio event loop
+# running in a background thread. Tasks are started with
+# asyncio.create_subprocess_exec, so thousands of concurrent srun steps
+# need neither a thread nor a blocked call each
+class asyncio_launcher(process_launcher):
+
+    def __init__(self, transport='local', job_id=0, memory_interval=None, sacct_memory=False):
+        super().__init__(transport, job_id, memory_interval, sacct_memory)
+        self._loop   = event_loop_thread.acquire()
+        # running processes and tasks to kill, only used from the loop thread
+        self._processes = {}
+        self._killed    = set()
+
+    async def _run(self, task_id, command, logs, step):
+        files = open_logs(logs)
+        try:
+            if task_id in self._killed:
+                return subprocess.CompletedProcess(command, -signal.SIGTERM)
+            process = await asyncio.create_subprocess_exec(*command, stdin=subprocess.DEVNULL,
+                                                           stdout=files[0], stderr=files[1])
+            self._processes[task_id] = process
+            start_time = time.time()
+            if self._sampler is not None:
+                self._sampler.add(task_id, process.pid)
+            await process.wait()
+            end_time = time.time()
+        finally:
+            self._processes.pop(task_id, None)
+            close_logs(files)
+        if self._sampler is not None:
+            return task_result(command, process.returncode, start_time=start_time, end_time=end_time,
+                               peak_memory=self._sampler.remove(task_id),
+                               mem_available=splinter_memory.mem_available())
+        if self._sacct_memory:
+            # sacct blocks, keep it off the loop
+            peak = await asyncio.get_running_loop().run_in_executor(
+                None, self.sacct_peak_memory, step)
+            return task_result(command, process.returncode, start_time=start_time, end_time=end_time,
+                               peak_memory=peak)
+        return task_result(command, process.returncode, start_time=start_time, end_time=end_time)
+
+    # returns a concurrent.futures.Future, safe to call from any thread
+    def _launch(self, task, logs):
+        return asyncio.run_coroutine_threadsafe(self._run(task.task_id(), self.command(task), logs, step_name(task)),
+                                                self._loop)
+
+    def _kill_in_loop(self, task_id):
+        self._killed.add(task_id)
+        process = self._processes.get(task_id)
+        if process is not None and process.returncode is None:
+            process.terminate()
+
+    def _kill(self, task):
+        self.kill_remote(task)
+        self._loop.call_soon_threadsafe(self._kill_in_loop, task.task_id())
+
+    def shutdown(self):
+        event_loop_thread.release()
+        super().shutdown()
+
+# -------------------------------------------------------------------
+# the agent script, started once per node by agent_launcher
+agent_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'splinter_agent.py')
+
+# -------------------------------------------------------------------
+# command used to start the agent on a node, with srun it is a single step
+# spanning all the cores of the node and binding is left to the tasks.
+# The agent samples the memory of its tasks every memory_interval seconds
+def agent_command(node, cores, srun, job_id, python='python3', memory_interval=None):
+    interval = [str(memory_interval or 0)]
+    if srun:
+        commands = f'srun --jobid={job_id} -w {node} -u -N 1 -n 1 -c {cores} --cpu-bind=none --mem-per-cpu=0 --overcommit --overlap'
+        return commands.split(' ') + [python, agent_script] + interval
+    # local stand-in agent
+    return [sys.executable, agent_script] + interval
+
+# -------------------------------------------------------------------
+# a launch agent running on one node, commands are written to its stdin
+# and a reader thread resolves the futures as replies come back
+class node_agent:
+
+    def __init__(self, node, command):
+        self._node    = node
+        self._lock    = threading.Lock()
+        self._futures = {}
+        self._commands = {}
+        # set once the agent has gone and its outstanding futures have failed
+        self._exited  = False
+        print('Starting launch agent on', node, ' '.join(command))
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         encoding='utf-8', bufsize=1)
+        self._reader = threading.Thread(target=self._read_replies, name='splinter-agent-' + node, daemon=True)
+        self._reader.start()
+
+    def _read_replies(self):
+        for line in self._process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                # srun or the remote shell may print other things, pass them on
+                print(self._node, ':', line.rstrip())
+                continue
+            with self._lock:
+                future  = self._futures.pop(message['id'])
+                command = self._commands.pop(message['id'])
+            if 'error' in message:
+                print('Agent on', self._node, 'could not start', command, ':', message['error'])
+            future.set_result(task_result(command, message['returncode'],
+                                          start_time=message['start'], end_time=message['end'],
+                                          peak_memory=message.get('peak_memory'),
+                                          mem_available=message.get('mem_available')))
+        # agent has gone, nothing still outstanding will ever complete
+        self._process.wait()
+        with self._lock:
+            self._exited = True
+            for future in self._futures.values():
+                future.set_exception(RuntimeError('launch agent on ' + self._node + ' exited'))
+            self._futures.clear()
+
+    # the agent writes the output of the command to the logs files itself.
+    # When the agent has exited the future fails at once, so the task fails
+    # (or is retried) like any other
+    def launch(self, request_id, command, logs=None):
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._exited or self._process.poll() is not None:
+                future.set_exception(RuntimeError('launch agent on ' + self._node + ' exited'))
+                return future
+            self._futures[request_id]  = future
+            self._commands[request_id] = command
+        request = {'id': request_id, 'command': command}
+        if logs is not None:
+            request['stdout'], request['stderr'] = logs
+        try:
+            self._process.stdin.write(json.dumps(request) + '\n')
+        except (OSError, ValueError) as exc:
+            # the pipe broke (or was closed), unless the reader failed it already
+            with self._lock:
+                pending = self._futures.pop(request_id, None)
+                self._commands.pop(request_id, None)
+            if pending is not None:
+                future.set_exception(RuntimeError('launch agent on ' + self._node + ' exited : ' + str(exc)))
+        return future
+
+    # a task of an agent that has gone is not running anyway
+    def kill(self, request_id):
+        try:
+            self._process.stdin.write(json.dumps({'kill': request_id}) + '\n')
+        except (OSError, ValueError):
+            pass
+
+    # no more commands, the agent finishes running tasks and exits
+    def shutdown(self):
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        self._reader.join()
+
+# -------------------------------------------------------------------
+# launcher using one persistent agent per node, started when the workflow
+# starts, so per task there is no srun step creation and no slurmctld
+# round trip, only a line written to a pipe.
+# nodes is a dict of node name to (cores, memory) as in the resource pool
+class agent_launcher(launcher):
+
+    def __init__(self, nodes, srun=False, job_id=0, memory_interval=None):
+        super().__init__()
+        self._request_id = itertools.count()
+        # request id of each running task, to kill it
+        self._requests = {}
+        self._agents = {}
+        if not srun:
+            # a single local stand-in agent runs everything
+            agent = node_agent('localhost', agent_command('localhost', 0, False, job_id,
+                                                          memory_interval=memory_interval))
+            self._agents = {node: agent for node in nodes}
+        else:
+            for node, data in nodes.items():
+                self._agents[node] = node_agent(node, agent_command(node, data[0], True, job_id,
+                                                                    memory_interval=memory_interval))
+
+    def _launch(self, task, logs):
+        request_id = next(self._request_id)
+        self._requests[task.task_id()] = request_id
+        future = self._agents[task.node()].launch(request_id, bound_command(task), logs)
+        future.add_done_callback(lambda f: self._requests.pop(task.task_id(), None))
+        return future
+
+    def _kill(self, task):
+        request_id = self._requests.get(task.task_id())
+        if request_id is not None:
+            self._agents[task.node()].kill(request_id)
+
+    def shutdown(self):
+        for agent in set(self._agents.values()):
+            agent.shutdown()
+
+# -------------------------------------------------------------------
+# launcher that runs nothing, every task completes at once with exit code 0,
+# so that the scheduler can be measured on its own (see splinter_benchmark)
+class null_launcher(launcher):
+
+    def _launch(self, task, logs):
+        future = concurrent.futures.Future()
+        now = time.time()
+        future.set_result(task_result(task.command(), 0, start_time=now, end_time=now))
+        return future
+
+# -------------------------------------------------------------------
+# names accepted by splinter_workflow.execute_workflow(launcher=...),
+# threads and asyncio use srun inside an allocation (srun=True) and run
+# tasks locally otherwise, local, srun and ssh are asyncio launchers with
+# that transport whatever srun is
+launchers = ('threads', 'asyncio', 'agent', 'null') + transports
+
+# memory_interval (seconds) is how often the memory of running tasks is
+# sampled, 0 or None to not measure it, sacct_memory looks up the peak
+# memory of srun steps with sacct
+def make_launcher(name, max_jobs, srun, job_id, nodes, memory_interval=None, sacct_memory=False):
+    transport = 'srun' if srun else 'local'
+    if name=='threads':
+        return thread_launcher(max_jobs, transport, job_id, memory_interval, sacct_memory)
+    elif name=='asyncio':
+        return asyncio_launcher(transport, job_id, memory_interval, sacct_memory)
+    elif name in transports:
+        return asyncio_launcher(name, job_id, memory_interval, sacct_memory)
+    elif name=='agent':
+        return agent_launcher(nodes, srun, job_id, memory_interval)
+    elif name=='null':
+        return null_launcher()
+    raise ValueError('Unknown launcher ' + str(name))
@@ -0,0 +1,260 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Launch latency of the ways splinter can start a command, measured with a
+# trivial command (date, printing the time it ran) launched in batches at
+# increasing concurrency, at most concurrency launches in flight at once.
+#
+# backends
+#   local   : subprocess.run of the command
+#   srun    : splinter.execute_srun, an srun step in the allocation
+#   ssh     : splinter.execute_ssh_shell, a new ssh session per command
+#   ssh-mux : ssh over the multiplexed (ControlMaster) connections of
+#             splinter_launch.ssh_pool
+#
+# per launch, from the time the command printed (so on remote nodes the
+# node clocks must agree, NTP keeps them within a millisecond or so)
+#   latency : submit -> start, what the backend costs before the command runs
+#   reap    : end -> reaped, until the launching side knows it has finished
+#   time    : submit -> reaped, the whole launch
+# p50/p95/p99 of these and the throughput (launches per second) of each
+# batch are printed. When the date on the node has no nanoseconds
+# (macOS) only time is measured.
+#
+# Outside of a SLURM allocation (a laptop) srun and ssh are replaced by
+# stand-ins that drop their options and run the command locally, so what is
+# measured is the python side of each backend. --stand-ins no uses the real
+# ones, e.g. ssh to localhost.
+#
+# The CSV has one row per launch (index is backend-concurrency-launch) and
+# loads with maestro_plotutils.read_pandas_csv, columns
+#   backend, stand_in, concurrency, node, returncode,
+#   submit, start, reaped : seconds from the start of the batch
+#   latency, reap, time   : as above
+#   ftime      : start of the batch -> reaped
+#   futures    : launches in flight when this one was submitted
+#   threads    : concurrency of the batch
+#   numa       : -1, launches are not bound
+#   throughput : launches per second of the batch
+#
+# usage : python splinter_launch_benchmark.py [--backends local srun ssh ssh-mux]
+#             [--concurrency 1 2 4 ...] [--launches 256] [--hosts node ...]
+#             [--stand-ins auto|yes|no] [--output path]
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import splinter
+import splinter_launch
+import splinter_history
+
+backends = ('local', 'srun', 'ssh', 'ssh-mux')
+
+default_output = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'launch-latency.csv')
+
+# the trivial command, prints the time it runs
+trivial_command = ['date', '+%s.%N']
+
+# -------------------------------------------------------------------
+# stand-ins for srun and ssh, they skip the options (and the host for ssh)
+# and run the command here, ssh without a command runs the script on stdin
+srun_stand_in = '''#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -w|-N|-n|-c|-J) shift 2 ;;
+    -*) shift ;;
+    *) break ;;
+  esac
+done
+exec "$@"
+'''
+
+ssh_stand_in = '''#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -O) exit 0 ;;
+    -o|-p|-l|-i) shift 2 ;;
+    -*) shift ;;
+    *) break ;;
+  esac
+done
+shift
+if [ $# -eq 0 ]; then exec /bin/bash; fi
+exec /bin/bash -c "$*"
+'''
+
+# -------------------------------------------------------------------
+# put the stand-ins first on the PATH while the context is active
+@contextlib.contextmanager
+def stand_ins():
+    path = os.environ.get('PATH', '')
+    with tempfile.TemporaryDirectory(prefix='splinter-stand-ins-') as directory:
+        for name, script in (('srun', srun_stand_in), ('ssh', ssh_stand_in)):
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(script)
+            os.chmod(os.path.join(directory, name), 0o755)
+        os.environ['PATH'] = directory + os.pathsep + path
+        try:
+            yield directory
+        finally:
+            os.environ['PATH'] = path
+
+# -------------------------------------------------------------------
+# a function launching a command on a host through a backend, returning a
+# future of its result (a CompletedProcess, or the output for ssh)
+def backend_launch(backend, job_id, pool):
+    if backend=='local':
+        return lambda executor, host, command: executor.submit(subprocess.run, command, stdout=subprocess.PIPE)
+    elif backend=='srun':
+        return lambda executor, host, command: splinter.execute_srun(executor, job_id, host, command)
+    elif backend=='ssh':
+        return lambda executor, host, command: executor.submit(splinter.execute_ssh_shell, host, ' '.join(command))
+    elif backend=='ssh-mux':
+        return lambda executor, host, command: executor.submit(subprocess.run, pool.command(host, command),
+                                                               stdout=subprocess.PIPE)
+    raise ValueError('Unknown launch backend ' + str(backend))
+
+# -------------------------------------------------------------------
+# (output, returncode) of a launch, the returncode of an ssh shell is not known
+def launch_output(result):
+    if isinstance(result, str):
+        return result, 0
+    output = result.stdout
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+    return output or '', result.returncode
+
+# the time printed by the command, None if it did not print one we can read
+def printed_time(output):
+    for line in reversed(output.strip().splitlines()):
+        try:
+            return float(line)
+        except ValueError:
+            continue
+    return None
+
+# -------------------------------------------------------------------
+# launch count commands with at most concurrency in flight, hosts in turn,
+# returns one record per launch (times are epoch seconds) and the seconds
+# from the first submit to the last reaped
+def run_batch(launch, hosts, concurrency, count):
+    slots   = threading.Semaphore(concurrency)
+    lock    = threading.Lock()
+    records = [None]*count
+    in_flight = [0]
+
+    def reaped(future, i, host, submit, futures):
+        reaped_time = time.time()
+        try:
+            output, returncode = launch_output(future.result())
+        except Exception as exc:
+            output, returncode = str(exc), -1
+        records[i] = {'node': host, 'submit': submit, 'start': printed_time(output), 'reaped': reaped_time,
+                      'futures': futures, 'returncode': returncode}
+        with lock:
+            in_flight[0] -= 1
+        slots.release()
+
+    devnull = open(os.devnull, 'w')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            contextlib.redirect_stdout(devnull):
+        start = time.time()
+        for i in range(count):
+            slots.acquire()
+            host = hosts[i % len(hosts)]
+            with lock:
+                futures = in_flight[0]
+                in_flight[0] += 1
+            submit = time.time()
+            future = launch(executor, host, trivial_command)
+            future.add_done_callback(lambda f, i=i, host=host, submit=submit, futures=futures:
+                                     reaped(f, i, host, submit, futures))
+    devnull.close()
+    return records, max([record['reaped'] for record in records]) - start
+
+# -------------------------------------------------------------------
+# the CSV rows of a batch, times relative to its first submit
+def batch_rows(backend, stand_in, concurrency, records, seconds):
+    nan = float('nan')
+    origin = min([record['submit'] for record in records])
+    throughput = len(records)/seconds if seconds>0 else 0
+    rows = []
+    for i, record in enumerate(records):
+        start = record['start'] if record['start'] is not None else nan
+        rows.append({'launch': '{}-{}-{:05d}'.format(backend, concurrency, i), 'backend': backend,
+                     'stand_in': int(stand_in), 'concurrency': concurrency, 'node': record['node'],
+                     'returncode': record['returncode'],
+                     'submit': record['submit'] - origin, 'start': start - origin,
+                     'reaped': record['reaped'] - origin,
+                     'latency': start - record['submit'], 'reap': record['reaped'] - start,
+                     'time': record['reaped'] - record['submit'], 'ftime': record['reaped'] - origin,
+                     'futures': record['futures'], 'threads': concurrency, 'numa': -1,
+                     'throughput': throughput})
+    return rows
+
+columns = ['launch', 'backend', 'stand_in', 'concurrency', 'node', 'returncode', 'submit', 'start', 'reaped',
+           'latency', 'reap', 'time', 'ftime', 'futures', 'threads', 'numa', 'throughput']
+
+def write_rows(path, rows):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+# -------------------------------------------------------------------
+# p50, p95 and p99 of a column in milliseconds, measured values only
+def percentiles_ms(rows, column):
+    values = [row[column]*1000 for row in rows if row[column]==row[column]]
+    return [splinter_history.percentile(values, p) for p in (50, 95, 99)]
+
+def format_ms(values):
+    return ' '.join(['{:>7.1f}'.format(v) if v is not None else '{:>7}'.format('-') for v in values])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='launch latency of the splinter execution backends')
+    parser.add_argument('--backends', nargs='+', default=list(backends), choices=backends)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                        help='launches in flight at once, one batch each')
+    parser.add_argument('--launches', type=int, default=256, help='launches per batch')
+    parser.add_argument('--hosts', nargs='+', help='nodes launched on in turn (default the SLURM nodelist)')
+    parser.add_argument('--stand-ins', default='auto', choices=('auto', 'yes', 'no'),
+                        help='local stand-ins for srun and ssh, auto when not in a SLURM job')
+    parser.add_argument('--output', default=default_output, help='CSV file of the launches')
+    args = parser.parse_args()
+
+    use_stand_ins = args.stand_ins=='yes' or (args.stand_ins=='auto' and not os.getenv('SLURM_JOB_ID'))
+    job_id = splinter.get_slurm_job()
+    hosts  = args.hosts if args.hosts else splinter.get_slurm_nodelist()
+
+    rows = []
+    print('{:8} {:>5} {:>8} | {:^23} | {:^23} | {:^23} | {:>9}'.format(
+        'backend', 'conc', 'launches', 'submit->start ms', 'end->reaped ms', 'submit->reaped ms', 'launch/s'))
+    print('{:8} {:>5} {:>8} | {} | {} | {} |'.format('', '', '', *[' '.join(['{:>7}'.format(p) for p in
+                                                                              ('p50', 'p95', 'p99')])]*3))
+    with contextlib.ExitStack() as stack:
+        if use_stand_ins:
+            stack.enter_context(stand_ins())
+        pool = splinter_launch.ssh_pool()
+        stack.callback(pool.close)
+        for backend in args.backends:
+            launch = backend_launch(backend, job_id, pool)
+            for concurrency in args.concurrency:
+                records, seconds = run_batch(launch, hosts, concurrency, max(args.launches, concurrency))
+                batch = batch_rows(backend, use_stand_ins, concurrency, records, seconds)
+                rows += batch
+                errors = len([row for row in batch if row['returncode']!=0])
+                print('{:8} {:>5} {:>8} | {} | {} | {} | {:>9.1f}{}'.format(
+                    backend, concurrency, len(batch), format_ms(percentiles_ms(batch, 'latency')),
+                    format_ms(percentiles_ms(batch, 'reap')), format_ms(percentiles_ms(batch, 'time')),
+                    batch[0]['throughput'], '  ({} failed)'.format(errors) if errors else ''))
+    write_rows(args.output, rows)
+    print('Launches written to', args.output, '(stand-ins for srun and ssh)' if use_stand_ins else '')
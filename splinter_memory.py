@@ -0,0 +1,176 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Measurement of the memory tasks actually use, so that memory can be
+# reserved from what earlier runs needed rather than from guesses.
+# Where the peak resident set size (RSS) of a task comes from
+#   - a task run directly on a node (locally, or by the launch agent) is
+#     sampled from /proc : the RSS of the task and all its descendants,
+#     plus VmHWM (the kernel's high water mark) of the task process, and
+#     memory.peak of its cgroup when it runs in a cgroup of its own
+#   - a task run in an srun step of its own is looked up with sacct
+#     (MaxRSS of the step) once the step has finished, when asked for
+#     (sacct_memory) as the task then waits for the accounting database
+# mem_available() is the live free memory of the node (MemAvailable), it is
+# reported with each completed task so the scheduler can hold back launches
+# on nodes that are short of memory.
+
+import os
+import subprocess
+import threading
+import time
+
+# -------------------------------------------------------------------
+# a size as printed by slurm (e.g. 1234K, 5.5M, 2G) in bytes, None if empty
+def parse_size(text):
+    text = text.strip()
+    if not text:
+        return None
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if text[-1].upper() in units:
+        return int(float(text[:-1])*units[text[-1].upper()])
+    return int(float(text))
+
+# -------------------------------------------------------------------
+# a field of /proc/<pid>/status in bytes (VmRSS, VmHWM), None if gone
+def proc_status_bytes(pid, field):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+# -------------------------------------------------------------------
+# pids of the children of a process (all of its threads)
+def child_pids(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+# -------------------------------------------------------------------
+# current RSS of a process and all its descendants
+def tree_rss(pid):
+    total = 0
+    stack = [pid]
+    while stack:
+        pid = stack.pop()
+        rss = proc_status_bytes(pid, 'VmRSS')
+        if rss is None:
+            continue
+        total += rss
+        stack += child_pids(pid)
+    return total
+
+# -------------------------------------------------------------------
+# memory.peak of the cgroup (v2) of a process, only when it is not our own
+# cgroup, i.e. the task has a cgroup to itself (a slurm step, systemd-run...)
+def cgroup_memory_peak(pid):
+    try:
+        with open(f'/proc/{pid}/cgroup') as f:
+            cgroup = f.read().strip().split(':')[-1]
+        with open('/proc/self/cgroup') as f:
+            if f.read().strip().split(':')[-1]==cgroup:
+                return None
+        with open('/sys/fs/cgroup' + cgroup + '/memory.peak') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+# -------------------------------------------------------------------
+# MemAvailable of this node in bytes, None when /proc/meminfo is missing
+def mem_available():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+# -------------------------------------------------------------------
+# peak memory of running processes, sample() is called every interval
+# seconds (by a thread of its own with start(), or by an event loop) and
+# remove() returns the peak seen once the process has exited
+class peak_sampler:
+
+    def __init__(self, interval=0.5):
+        self._interval = interval
+        self._lock  = threading.Lock()
+        self._peaks = {}
+        self._stop  = None
+
+    def interval(self):
+        return self._interval
+
+    # start watching a process, the first sample is taken at once
+    def add(self, key, pid):
+        with self._lock:
+            self._peaks[key] = [pid, 0]
+        self._sample(key, pid)
+
+    def _sample(self, key, pid):
+        # VmHWM also covers spikes between two samples of a single process
+        peak = max(tree_rss(pid), proc_status_bytes(pid, 'VmHWM') or 0, cgroup_memory_peak(pid) or 0)
+        with self._lock:
+            if key in self._peaks and peak>self._peaks[key][1]:
+                self._peaks[key][1] = peak
+
+    def sample(self):
+        with self._lock:
+            watched = [(key, entry[0]) for key, entry in self._peaks.items()]
+        for key, pid in watched:
+            self._sample(key, pid)
+
+    # peak in bytes, None if nothing could be read
+    def remove(self, key):
+        with self._lock:
+            entry = self._peaks.pop(key, None)
+        if entry is None or entry[1]==0:
+            return None
+        return entry[1]
+
+    # -------------------------------------------------------------------
+    # sample from a daemon thread until stop()
+    def start(self):
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, args=(self._stop,), name='splinter-memory', daemon=True).start()
+
+    def _run(self, stop):
+        while not stop.wait(self._interval):
+            self.sample()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+# -------------------------------------------------------------------
+# MaxRSS of the srun step step_id of a job, from the accounting database,
+# only the record of that step is read. The record of a step can take a
+# moment to appear after it ends, so the query is repeated a few times.
+# None if it never shows up or accounting is not available
+def sacct_peak_memory(job_id, step_id, attempts=3, delay=1.0):
+    command = ['sacct', '-j', str(job_id) + '.' + str(step_id), '-n', '-P', '--noconvert', '-o', 'MaxRSS']
+    for attempt in range(attempts):
+        try:
+            output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    encoding='utf-8', timeout=30).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        peak = None
+        for line in output.splitlines():
+            if line.strip():
+                peak = parse_size(line)
+        if peak is not None:
+            return peak
+        if attempt<attempts - 1:
+            time.sleep(delay)
+    return None
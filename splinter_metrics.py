@@ -0,0 +1,209 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Live metrics of a running splinter workflow : tasks by state, free cores
+# and memory per node, launch latency, scheduler loop time and throughput.
+# The scheduler only updates counters, gauges and histogram buckets (all
+# O(1) per event), the text is produced when someone asks for it, either
+#   - Prometheus text format on http://<address>:<port>/metrics, served from
+#     a background thread when a port is given (curl it, or point a
+#     Prometheus/Grafana at it to watch the allocation live). Only this host
+#     can reach it unless a wider address is asked for, e.g. '' for all
+#     interfaces, the metrics show node names and the state of the job
+#   - summary_line(), the one line status report printed by the scheduler
+
+import http.server
+import socket
+import threading
+import time
+import bisect
+
+# -------------------------------------------------------------------
+# a histogram with fixed bucket upper bounds (seconds), Prometheus style
+class histogram:
+
+    def __init__(self, bounds):
+        self._bounds = list(bounds)
+        self._counts = [0]*(len(self._bounds)+1)
+        self._sum    = 0.0
+        self._count  = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self._sum   += value
+        self._count += 1
+
+    def count(self):
+        return self._count
+
+    # value below which a fraction p (0-1) of observations lie, taken as the
+    # upper bound of the bucket it falls in
+    def quantile(self, p):
+        if self._count==0:
+            return None
+        target = p*self._count
+        total = 0
+        for i, n in enumerate(self._counts):
+            total += n
+            if total>=target:
+                return self._bounds[i] if i<len(self._bounds) else float('inf')
+        return float('inf')
+
+    def lines(self, name):
+        lines = []
+        total = 0
+        for bound, n in zip(self._bounds + [float('+inf')], self._counts):
+            total += n
+            le = '+Inf' if bound==float('+inf') else repr(bound)
+            lines.append(f'{name}_bucket{{le="{le}"}} {total}')
+        lines.append(f'{name}_sum {self._sum}')
+        lines.append(f'{name}_count {self._count}')
+        return lines
+
+# bucket bounds (seconds) of the latency and loop time histograms
+latency_buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+loop_buckets    = [0.00001, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 1]
+
+# task states reported
+task_states = ('blocked', 'ready', 'deferred', 'running', 'completed', 'failed', 'cancelled')
+
+# -------------------------------------------------------------------
+# metrics of one workflow run, nodes is a callable returning a list of
+# (node, free cpus, total cpus, free memory, total memory) used for
+# the per node gauges, it is only called when metrics are read.
+# clock returns the current time, that of the scheduler (default time.time)
+class workflow_metrics:
+
+    def __init__(self, nodes=None, clock=None):
+        self._nodes   = nodes
+        self._clock   = clock if clock is not None else time.time
+        self._start   = self._clock()
+        self._states  = dict.fromkeys(task_states, 0)
+        self._launched = 0
+        self._latency = histogram(latency_buckets)
+        self._loop    = histogram(loop_buckets)
+        # completions at the last summary, to report the recent rate
+        self._last_time = self._start
+        self._last_done = 0
+        self._server  = None
+
+    # -------------------------------------------------------------------
+    # updated by the scheduler
+    def set_states(self, blocked, ready, deferred, cancelled=0):
+        self._states['blocked']   = blocked
+        self._states['ready']     = ready
+        self._states['deferred']  = deferred
+        self._states['cancelled'] = cancelled
+
+    def launched(self):
+        self._launched += 1
+        self._states['running'] += 1
+
+    # latency is the time from submission until the task started
+    def finished(self, exit_code, latency):
+        self._states['running'] -= 1
+        self._states['completed' if exit_code==0 else 'failed'] += 1
+        if latency is not None and latency>=0:
+            self._latency.observe(latency)
+
+    # time spent in one pass of the scheduler loop, excluding the wait
+    def loop_time(self, seconds):
+        self._loop.observe(seconds)
+
+    def done(self):
+        return self._states['completed'] + self._states['failed']
+
+    # -------------------------------------------------------------------
+    # Prometheus text exposition format
+    def prometheus_text(self):
+        elapsed = self._clock() - self._start
+        lines = ['# HELP splinter_tasks Tasks of the workflow by state',
+                 '# TYPE splinter_tasks gauge']
+        for state, n in self._states.items():
+            lines.append(f'splinter_tasks{{state="{state}"}} {n}')
+        lines += ['# HELP splinter_tasks_launched_total Tasks launched',
+                  '# TYPE splinter_tasks_launched_total counter',
+                  f'splinter_tasks_launched_total {self._launched}',
+                  '# HELP splinter_tasks_per_second Tasks finished per second since the start',
+                  '# TYPE splinter_tasks_per_second gauge',
+                  f'splinter_tasks_per_second {self.done()/elapsed if elapsed>0 else 0}',
+                  '# HELP splinter_elapsed_seconds Time since the workflow started',
+                  '# TYPE splinter_elapsed_seconds gauge',
+                  f'splinter_elapsed_seconds {elapsed}']
+        if self._nodes is not None:
+            nodes = self._nodes()
+            lines += ['# HELP splinter_node_free_cpus Free cpus per node',
+                      '# TYPE splinter_node_free_cpus gauge']
+            lines += [f'splinter_node_free_cpus{{node="{n[0]}"}} {n[1]}' for n in nodes]
+            lines += ['# HELP splinter_node_cpus Schedulable cpus per node',
+                      '# TYPE splinter_node_cpus gauge']
+            lines += [f'splinter_node_cpus{{node="{n[0]}"}} {n[2]}' for n in nodes]
+            lines += ['# HELP splinter_node_free_memory_bytes Free memory per node',
+                      '# TYPE splinter_node_free_memory_bytes gauge']
+            lines += [f'splinter_node_free_memory_bytes{{node="{n[0]}"}} {n[3]}' for n in nodes]
+            lines += ['# HELP splinter_node_memory_bytes Schedulable memory per node',
+                      '# TYPE splinter_node_memory_bytes gauge']
+            lines += [f'splinter_node_memory_bytes{{node="{n[0]}"}} {n[4]}' for n in nodes]
+        lines += ['# HELP splinter_launch_latency_seconds Time from submission to the task starting',
+                  '# TYPE splinter_launch_latency_seconds histogram']
+        lines += self._latency.lines('splinter_launch_latency_seconds')
+        lines += ['# HELP splinter_loop_seconds Time spent in one pass of the scheduler loop',
+                  '# TYPE splinter_loop_seconds histogram']
+        lines += self._loop.lines('splinter_loop_seconds')
+        return '\n'.join(lines) + '\n'
+
+    # -------------------------------------------------------------------
+    # compact status report, O(nodes) at most whatever the number of tasks
+    def summary_line(self):
+        now = self._clock()
+        done = self.done()
+        rate = (done - self._last_done)/(now - self._last_time) if now>self._last_time else 0
+        self._last_time, self._last_done = now, done
+        s = self._states
+        line = ('[{:.0f}s] done {}/{} failed {} cancelled {} running {} ready {} deferred {} blocked {} rate {:.1f}/s'
+                .format(now - self._start, s['completed'],
+                        done + s['cancelled'] + s['running'] + s['ready'] + s['deferred'] + s['blocked'],
+                        s['failed'], s['cancelled'], s['running'], s['ready'], s['deferred'], s['blocked'], rate))
+        if self._nodes is not None:
+            nodes = self._nodes()
+            free  = sum([n[1] for n in nodes])
+            total = sum([n[2] for n in nodes])
+            idle  = sum([1 for n in nodes if n[1]==n[2]])
+            line += ' cpus busy {}/{} idle nodes {}'.format(total - free, total, idle)
+        p95 = self._latency.quantile(0.95)
+        if p95 is not None:
+            line += ' launch p95 <{}s'.format(p95)
+        return line
+
+    # -------------------------------------------------------------------
+    # serve /metrics on a port (0 picks a free one) from a daemon thread,
+    # on the loopback interface unless another address is given
+    def serve(self, port, address='127.0.0.1'):
+        metrics = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((address, port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='splinter-metrics', daemon=True).start()
+        print('Metrics on http://{}:{}/metrics'.format(address or socket.gethostname(), self._server.server_address[1]))
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,270 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Discrete event simulation of splinter scheduling. The real scheduler
+# (splinter_workflow.execute_workflow with its priority, placement, locality
+# and failure policies) runs unchanged, but its tasks are given to a
+# launcher that starts nothing : each task completes after its duration on
+# a virtual clock, and waiting for the next completion moves the clock
+# straight to it. A DAG of 100k tasks simulates in seconds on a laptop, so
+# policies can be compared without an allocation.
+#
+# inputs
+#   nodes     : the node_pool of the workflow, a dict of node name to
+#               (cpus, memory) from synthetic_nodes(), or recorded_nodes()
+#               for the nodes of a cluster probed earlier (topology cache)
+#   durations : seconds per task, a dict by task id, a callable(task) or
+#               recorded_durations() of the trace CSV of a real run,
+#               by default the task cost, or 1 second
+#   bandwidth : when given (bytes/s), a task reading inputs produced on
+#               another node takes that much longer, so locality counts
+# simulate() returns a report : makespan, utilisation of the cpus, the
+# waits of tasks (ready until started), and the real time the scheduler
+# took. Per task waits are in the trace of the workflow (trace().rows()).
+#
+# usage : python splinter_simulate.py [tasks] [nodes] [cpus per node]
+#   compares fifo, critical path, and critical path with locality on a
+#   synthetic layered DAG, with as many tasks per layer as there are cpus
+
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import math
+import os
+import random
+import signal
+import sys
+import time
+import csv
+import splinter
+import splinter_launch
+import splinter_history
+import splinter_topology
+
+# -------------------------------------------------------------------
+# virtual time, starting at 0. Completions are kept in a heap, wait()
+# completes the next one (and all those due at the same time) and moves the
+# clock to it, or moves the clock on by timeout if that comes first
+class virtual_clock:
+
+    def __init__(self):
+        self._now = 0.0
+        self._events = []
+        self._order  = itertools.count()
+        # futures completed and not yet returned by wait
+        self._completed = []
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self._now += max(0, seconds)
+
+    # future completes with result at time at
+    def schedule(self, at, future, result):
+        heapq.heappush(self._events, (at, next(self._order), future, result))
+
+    # future completes with result now (e.g. a killed task)
+    def complete(self, future, result):
+        future.set_result(result)
+        self._completed.append(future)
+
+    # the futures of launched tasks are completed by the clock itself, it
+    # needs not watch them
+    def watch(self, future):
+        pass
+
+    # others (set from outside the simulation) are checked first
+    def wait(self, others, timeout=None):
+        done = set([future for future in others if future.done()])
+        if len(done)!=0 or len(self._completed)!=0:
+            done.update(self._completed)
+            self._completed = []
+            return done
+        if len(self._events)==0 or (timeout is not None and self._events[0][0]>self._now + timeout):
+            if timeout is None:
+                raise RuntimeError('simulation has nothing left to wait for')
+            self._now += timeout
+            return done
+        self._now = max(self._now, self._events[0][0])
+        while len(self._events)!=0 and self._events[0][0]<=self._now:
+            at, order, future, result = heapq.heappop(self._events)
+            if not future.done():
+                future.set_result(result)
+                done.add(future)
+        return done
+
+# -------------------------------------------------------------------
+# a function giving the duration (seconds) of a task from durations, see above
+def duration_function(durations):
+    if durations is None:
+        return splinter.default_task_cost
+    if callable(durations):
+        return durations
+
+    def lookup(task):
+        duration = durations.get(task.task_id(), durations.get(str(task.task_id())))
+        return duration if duration is not None else splinter.default_task_cost(task)
+    return lookup
+
+# -------------------------------------------------------------------
+# launcher of simulated tasks, on its own virtual clock which the scheduler
+# runs on. Nothing is executed, every task succeeds after its duration
+# plus launch_latency, and the time to read remote inputs with a bandwidth
+class simulated_launcher:
+
+    def __init__(self, durations=None, launch_latency=0.0, bandwidth=None):
+        self._clock    = virtual_clock()
+        self._duration = duration_function(durations)
+        self._latency  = launch_latency
+        self._bandwidth = bandwidth
+        # node each output was written on, and bytes read from another node
+        self._location = {}
+        self._remote_bytes = 0
+        self._running  = {}
+
+    def clock(self):
+        return self._clock
+
+    def remote_bytes(self):
+        return self._remote_bytes
+
+    def launch(self, task, logs=None):
+        future = concurrent.futures.Future()
+        start = self._clock.time() + self._latency
+        duration = self._duration(task)
+        remote = sum([size for name, size in task.inputs().items()
+                      if self._location.get(name, task.node())!=task.node()])
+        self._remote_bytes += remote
+        if self._bandwidth:
+            duration += remote/self._bandwidth
+        for name in task.outputs():
+            self._location[name] = task.node()
+        result = splinter_launch.task_result(task.command(), 0, start_time=start, end_time=start + duration)
+        self._clock.schedule(start + duration, future, result)
+        self._running[task.task_id()] = (future, start)
+        future.add_done_callback(lambda f: self._running.pop(task.task_id(), None))
+        return future
+
+    def kill(self, task):
+        running = self._running.get(task.task_id())
+        if running is not None and not running[0].done():
+            self._clock.complete(running[0], splinter_launch.task_result(
+                task.command(), -signal.SIGTERM, start_time=running[1], end_time=self._clock.time()))
+
+    def shutdown(self):
+        pass
+
+# -------------------------------------------------------------------
+# count nodes named <prefix>00000 ... with cpus and memory (bytes) each
+def synthetic_nodes(count, cpus, memory=64*2**30, prefix='nid'):
+    return {'{}{:05d}'.format(prefix, i): (cpus, memory) for i in range(count)}
+
+# -------------------------------------------------------------------
+# the nodes of this cluster in the topology cache (see splinter_topology),
+# as the (nodes, topology) a node_pool is made from
+def recorded_nodes(path=None, schedulable_unit='core'):
+    nodes, topology = {}, {}
+    for node, record in splinter_topology.topology_cache(path).records().items():
+        topology[node] = splinter_topology.node_topology.from_record(record)
+        nodes[node] = (record['cores'] if schedulable_unit=='core' else record['pus'], record['memory'])
+    return nodes, topology
+
+# -------------------------------------------------------------------
+# task durations (time column) of the trace CSV of a run, by task id
+def recorded_durations(path):
+    with open(path, newline='') as f:
+        return {row['task']: float(row['time']) for row in csv.DictReader(f)}
+
+# -------------------------------------------------------------------
+# task durations predicted from a splinter_history.task_history, tasks
+# never seen before take their cost, or 1 second
+def history_durations(history, p=50):
+    estimates = {}
+
+    def predict(task):
+        key = (task.name(), splinter_history.argument_data_size(task.command()[1:]))
+        if key not in estimates:
+            estimates[key] = history.predict_duration(*key, p=p)
+        return estimates[key] if estimates[key] is not None else splinter.default_task_cost(task)
+    return predict
+
+# -------------------------------------------------------------------
+# a layered random DAG of num_tasks tasks, width tasks per layer, each
+# depending on 1 to max_parents tasks of the layer above and reading their
+# outputs (data_size bytes each). Durations are lognormal around
+# mean_duration seconds and known to the scheduler (the task cost)
+def synthetic_tasks(num_tasks, width=100, max_parents=3, max_cores=4, memory=2*2**30,
+                    mean_duration=10.0, sigma=1.0, data_size=2**30, seed=0):
+    rng = random.Random(seed)
+    tasks = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(num_tasks):
+            layer_start = (i//width)*width
+            parents = []
+            if layer_start!=0:
+                above = range(layer_start - width, layer_start)
+                parents = rng.sample(above, rng.randint(1, min(max_parents, len(above))))
+            inputs = {'d' + str(parent): data_size for parent in parents}
+            new_task = splinter.task(i, ['synthetic', str(i)], parents, rng.randint(1, max_cores), memory,
+                                     name='synthetic', inputs=inputs, outputs={'d' + str(i): data_size})
+            new_task.set_cost(rng.lognormvariate(0, sigma)*mean_duration/math.exp(sigma*sigma/2))
+            tasks.append(new_task)
+    return tasks
+
+# -------------------------------------------------------------------
+# makespan, utilisation and waits of a simulated run, seconds is the real
+# time the simulation took
+def simulation_report(workflow, launcher, seconds):
+    rows = list(workflow.trace().rows())
+    makespan = max([row['end'] for row in rows], default=0)
+    busy  = sum([row['cores']*row['time'] for row in rows])
+    cpus  = workflow.pool().num_cpus()
+    waits = [row['wait'] for row in rows]
+    return {'tasks': len(rows),
+            'failed': len(workflow.failed_tasks()),
+            'cancelled': len(workflow.cancelled_tasks()),
+            'makespan': makespan,
+            'utilisation': busy/(cpus*makespan) if makespan>0 else 0,
+            'wait_mean': sum(waits)/len(waits) if len(waits)!=0 else 0,
+            'wait_p50': splinter_history.percentile(waits, 50),
+            'wait_p95': splinter_history.percentile(waits, 95),
+            'wait_max': max(waits, default=0),
+            'remote_bytes': launcher.remote_bytes(),
+            'scheduler_seconds': seconds,
+            'tasks_per_second': len(rows)/seconds if seconds>0 else 0}
+
+# -------------------------------------------------------------------
+# run the workflow (tasks added, not yet run) in simulation and report,
+# the scheduler output is discarded unless verbose, trace is a path
+# prefix for the trace files as in execute_workflow
+def simulate(workflow, durations=None, launch_latency=0.0, bandwidth=None, trace=None, verbose=False):
+    launcher = simulated_launcher(durations, launch_latency, bandwidth)
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        workflow.execute_workflow(0, False, launcher=launcher, trace=trace, log_dir=os.devnull)
+    return simulation_report(workflow, launcher, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    num_tasks = int(sys.argv[1]) if len(sys.argv)>1 else 10000
+    num_nodes = int(sys.argv[2]) if len(sys.argv)>2 else 16
+    num_cpus  = int(sys.argv[3]) if len(sys.argv)>3 else 36
+    nodes = synthetic_nodes(num_nodes, num_cpus)
+    policies = (('fifo', {'priority_policy': 'fifo'}),
+                ('critical_path', {'priority_policy': 'critical_path'}),
+                ('critical_path+locality', {'priority_policy': 'critical_path', 'locality_wait': 5}))
+    print('{} tasks on {} nodes of {} cpus, 1GB per dependency at 1GB/s'.format(num_tasks, num_nodes, num_cpus))
+    for label, options in policies:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            workflow = splinter.splinter_workflow(pool=splinter.node_pool(nodes=nodes, cpu_binding=False), **options)
+        for new_task in synthetic_tasks(num_tasks, width=num_nodes*num_cpus):
+            workflow.add_task(new_task)
+        report = simulate(workflow, bandwidth=2**30)
+        print('{:24} makespan {:10.1f}s utilisation {:5.1%} wait p50 {:8.1f}s p95 {:8.1f}s '
+              'remote {:8.1f}GB  ({:.1f}s, {:.0f} tasks/s)'.format(
+                  label, report['makespan'], report['utilisation'], report['wait_p50'], report['wait_p95'],
+                  report['remote_bytes']/2**30, report['scheduler_seconds'], report['tasks_per_second']))
@@ -0,0 +1,436 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Node topology for splinter : how the cores of a node are grouped into
+# NUMA domains and sockets and which PUs (hardware threads) belong to each
+# core, plus the allocator used to give each task a set of cores that
+# stays inside one NUMA domain (or socket) whenever it can.
+# Probed topologies are cached on disk so they are only discovered once.
+#
+# Run as a script (python3 splinter_topology.py, or its source piped into
+# python3 - on a remote node) it probes the node it runs on in a single pass,
+# from one 'lstopo --of xml' or from sysfs when hwloc is absent, and prints
+# one line holding a JSON node record (see probe_node). It only uses the
+# standard library so it can run on any node with python3.
+
+import json
+import os
+import time
+import socket
+import glob
+import shutil
+import subprocess
+import xml.etree.ElementTree as ElementTree
+
+# marker written before the JSON record so that login banners and the like
+# printed by ssh/srun can be told apart from the probe output
+record_marker = 'SPLINTER-TOPOLOGY '
+
+# -------------------------------------------------------------------
+# the hierarchy of one node
+# sockets : for each socket, the list of NUMA domain indices on it
+# numa    : for each NUMA domain, the list of core indices in it
+# cores   : for each core, the list of PU (OS cpu) indices it has
+class node_topology:
+
+    def __init__(self, sockets, numa, cores):
+        self._sockets = sockets
+        self._numa    = numa
+        self._cores   = cores
+
+    # build a topology from a node record (see probe_node)
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['socket_numa'], record['numa_cores'], record['core_pus'])
+
+    def sockets(self):
+        return self._sockets
+
+    def numa(self):
+        return self._numa
+
+    def cores(self):
+        return self._cores
+
+    def num_cores(self):
+        return len(self._cores)
+
+    def num_pus(self):
+        return sum([len(pus) for pus in self._cores])
+
+# -------------------------------------------------------------------
+# units that can be handed to tasks, either whole cores or single PUs (SMT)
+schedulable_units = ('core', 'pu')
+
+# -------------------------------------------------------------------
+# tracks the free units of each NUMA domain of a node and hands them out.
+# A task gets units from a single NUMA domain if one has enough free
+# (the fullest domain that fits, to keep large domains free for large tasks),
+# failing that from a single socket, failing that from the domains with the
+# most free units.
+class core_allocator:
+
+    def __init__(self, topology, unit='core'):
+        if unit not in schedulable_units:
+            raise ValueError('Unknown schedulable unit ' + str(unit))
+        self._topology = topology
+        self._unit     = unit
+        # PUs of each unit, and the free units of each NUMA domain
+        self._unit_pus = {}
+        self._free     = []
+        for domain in topology.numa():
+            free = []
+            for core in domain:
+                if unit=='core':
+                    self._unit_pus[core] = topology.cores()[core]
+                    free.append(core)
+                else:
+                    for pu in topology.cores()[core]:
+                        self._unit_pus[pu] = [pu]
+                        free.append(pu)
+            self._free.append(sorted(free))
+        self._domain_of = {u: d for d, free in enumerate(self._free) for u in free}
+
+    def num_units(self):
+        return len(self._unit_pus)
+
+    def num_free(self):
+        return sum([len(free) for free in self._free])
+
+    def _take(self, domains, n):
+        units = []
+        for d in domains:
+            count = min(n - len(units), len(self._free[d]))
+            units += self._free[d][:count]
+            self._free[d] = self._free[d][count:]
+            if len(units)==n:
+                break
+        return units
+
+    # returns a list of n units, or None if the node does not have n free
+    def allocate(self, n):
+        if n>self.num_free():
+            return None
+        by_free = sorted(range(len(self._free)), key=lambda d: len(self._free[d]))
+        # a single NUMA domain
+        for d in by_free:
+            if len(self._free[d])>=n:
+                return self._take([d], n)
+        # a single socket, its domains with most free units first
+        sockets = sorted(self._topology.sockets(), key=lambda s: sum([len(self._free[d]) for d in s]))
+        for socket in sockets:
+            if sum([len(self._free[d]) for d in socket])>=n:
+                return self._take(sorted(socket, key=lambda d: -len(self._free[d])), n)
+        # spread over the node
+        return self._take(list(reversed(by_free)), n)
+
+    def release(self, units):
+        domains = set()
+        for u in units:
+            d = self._domain_of[u]
+            self._free[d].append(u)
+            domains.add(d)
+        for d in domains:
+            self._free[d].sort()
+
+    # NUMA domain a unit belongs to
+    def domain(self, unit):
+        return self._domain_of[unit]
+
+    # OS cpu indices covered by a list of units
+    def pus(self, units):
+        return [pu for u in units for pu in self._unit_pus[u]]
+
+# -------------------------------------------------------------------
+# srun --cpu-bind mask for a list of OS cpu indices
+def cpu_mask(pus):
+    mask = 0
+    for pu in pus:
+        mask |= 1 << pu
+    return hex(mask)
+
+# -------------------------------------------------------------------
+# default location of the topology cache, can be moved with SPLINTER_CACHE
+def default_cache_path():
+    cache_dir = os.getenv('SPLINTER_CACHE')
+    if cache_dir is None:
+        cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'splinter')
+    return os.path.join(cache_dir, 'topology.json')
+
+# -------------------------------------------------------------------
+# the cluster a node name belongs to, node names such as nid00012 are
+# only unique within one machine
+def cluster_name():
+    return os.getenv('SLURM_CLUSTER_NAME', 'local')
+
+# -------------------------------------------------------------------
+# on disk cache of node data (as returned by the topology probe) keyed by
+# cluster and hostname. Each entry keeps the fingerprint reported by the
+# probe (kernel release, hwloc version) and the time it was stored, entries
+# older than ttl seconds are ignored. The fingerprint of the local host is
+# checked on every lookup, remote nodes are trusted until the entry expires
+# so that a cached lookup never has to contact them.
+class topology_cache:
+
+    # one week, hardware does not change often
+    default_ttl = 7*24*3600
+
+    def __init__(self, path=None, ttl=None):
+        self._path    = path if path is not None else default_cache_path()
+        self._ttl     = ttl if ttl is not None else self.default_ttl
+        self._entries = {}
+        try:
+            with open(self._path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            # missing or unreadable cache, start empty
+            self._entries = {}
+
+    def path(self):
+        return self._path
+
+    def _key(self, node):
+        return cluster_name() + ':' + node
+
+    def _is_local(self, node):
+        return node=='localhost' or node==socket.gethostname()
+
+    # node record from the cache, or None if absent, expired or stale
+    def get(self, node):
+        entry = self._entries.get(self._key(node))
+        # entries written before node records were used hold a plain list
+        if entry is None or not isinstance(entry['data'], dict):
+            return None
+        if time.time() - entry['time'] > self._ttl:
+            return None
+        if self._is_local(node) and entry['fingerprint'][:1]!=[os.uname().release]:
+            return None
+        return entry['data']
+
+    # every node record of this cluster in the cache, whatever its age, by
+    # node name (e.g. to simulate a run on nodes probed earlier)
+    def records(self):
+        prefix = cluster_name() + ':'
+        return {key[len(prefix):]: entry['data'] for key, entry in self._entries.items()
+                if key.startswith(prefix) and isinstance(entry['data'], dict)}
+
+    # record is the node record returned by the probe
+    def put(self, node, record):
+        self._entries[self._key(node)] = {'data': record,
+                                          'fingerprint': record['fingerprint'],
+                                          'time': time.time()}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        temp = self._path + '.' + str(os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(temp, self._path)
+
+# -------------------------------------------------------------------
+# Node probe
+# A node record is a dict with
+#   hostname, sockets, numa, cores, pus, memory  : counts and bytes
+#   socket_numa  : for each socket the NUMA domain indices on it
+#   numa_cores   : for each NUMA domain the core indices in it
+#   core_pus     : for each core its PU (OS cpu) indices
+#   numa_memory  : bytes of memory of each NUMA domain
+#   caches       : list of {level, size, pus} for every cache
+#   fingerprint  : [kernel release, hwloc version or 'sysfs']
+#   source       : 'hwloc' or 'sysfs'
+# -------------------------------------------------------------------
+
+# -------------------------------------------------------------------
+# OS cpu indices in an hwloc cpuset string such as 0x0000ffff,0xffffffff
+def parse_cpuset(cpuset):
+    words = cpuset.split(',')
+    if any(['...' in w for w in words]):
+        # infinite sets are never used for objects we care about
+        return set()
+    value = int(''.join([w.replace('0x', '').rjust(8, '0') for w in words]), 16)
+    pus = set()
+    bit = 0
+    while value:
+        if value & 1:
+            pus.add(bit)
+        value >>= 1
+        bit += 1
+    return pus
+
+# -------------------------------------------------------------------
+# linux cpu list such as 0-3,8-11
+def parse_cpulist(cpulist):
+    pus = set()
+    for part in cpulist.strip().split(','):
+        if part=='':
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            pus.update(range(int(first), int(last)+1))
+        else:
+            pus.add(int(part))
+    return pus
+
+# -------------------------------------------------------------------
+# assemble a node record from sets of PUs for each socket, NUMA domain and
+# core, which is what both hwloc and sysfs give us
+def make_record(socket_pus, numa_pus, numa_memory, core_pus, caches, memory, version, source):
+    # order everything by the first PU it contains
+    socket_pus = sorted(socket_pus, key=min)
+    order      = sorted(range(len(numa_pus)), key=lambda d: min(numa_pus[d]) if numa_pus[d] else 0)
+    numa_pus    = [numa_pus[d] for d in order]
+    numa_memory = [numa_memory[d] for d in order]
+    core_pus   = sorted(core_pus, key=min)
+    numa_cores  = [[c for c, pus in enumerate(core_pus) if min(pus) in domain] for domain in numa_pus]
+    socket_numa = [[d for d, domain in enumerate(numa_pus) if domain and min(domain) in pus] for pus in socket_pus]
+    return {'hostname'   : socket.gethostname(),
+            'sockets'    : len(socket_pus),
+            'numa'       : len(numa_pus),
+            'cores'      : len(core_pus),
+            'pus'        : sum([len(pus) for pus in core_pus]),
+            'memory'     : memory,
+            'socket_numa': socket_numa,
+            'numa_cores' : numa_cores,
+            'core_pus'   : [sorted(pus) for pus in core_pus],
+            'numa_memory': numa_memory,
+            'caches'     : caches,
+            'fingerprint': [os.uname().release, version],
+            'source'     : source}
+
+# -------------------------------------------------------------------
+# lstopo to use : $LSTOPO if it exists, otherwise whatever is on the PATH
+def find_lstopo():
+    lstopo = os.getenv('LSTOPO')
+    if lstopo and os.path.isfile(lstopo):
+        return lstopo
+    for name in ['lstopo-no-graphics', 'lstopo']:
+        path = shutil.which(name)
+        if path is not None:
+            return path
+    return None
+
+# -------------------------------------------------------------------
+# one run of lstopo --of xml, parsed into a node record (hwloc 1.x and 2.x)
+def probe_hwloc(lstopo):
+    xml = subprocess.run([lstopo, '--of', 'xml'], stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL, check=True).stdout
+    version = subprocess.run([lstopo, '--version'], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, encoding='utf-8').stdout.strip()
+    root = ElementTree.fromstring(xml)
+    socket_pus, numa_pus, numa_memory, core_pus, caches = [], [], [], [], []
+    for obj in root.iter('object'):
+        kind   = obj.get('type')
+        cpuset = parse_cpuset(obj.get('cpuset', '0x0'))
+        if kind in ('Package', 'Socket'):
+            socket_pus.append(cpuset)
+        elif kind=='NUMANode':
+            numa_pus.append(cpuset)
+            numa_memory.append(int(obj.get('local_memory', 0)))
+        elif kind=='Core':
+            core_pus.append(cpuset)
+        elif kind.endswith('Cache') and kind!='MemCache':
+            # hwloc 1.x has one Cache type, its level in depth and
+            # cache_type 2 for instruction caches, named as hwloc 2 does
+            level = kind if kind!='Cache' else \
+                'L' + obj.get('depth', '?') + ('i' if obj.get('cache_type')=='2' else '') + 'Cache'
+            caches.append({'level': level, 'size': int(obj.get('cache_size', 0)), 'pus': sorted(cpuset)})
+    machine = set().union(*core_pus) if core_pus else set()
+    if len(socket_pus)==0:
+        socket_pus = [machine]
+    if len(numa_pus)==0:
+        numa_pus = [machine]
+        numa_memory = [sum([int(o.get('local_memory', 0)) for o in root.iter('object')])]
+    if len(core_pus)==0:
+        core_pus = [{pu} for pu in sorted(machine)]
+    return make_record(socket_pus, numa_pus, numa_memory, core_pus, caches,
+                       sum(numa_memory), version, 'hwloc')
+
+def read_file(path):
+    with open(path) as f:
+        return f.read().strip()
+
+# -------------------------------------------------------------------
+# the same information from /sys and /proc when hwloc is not installed
+def probe_sysfs():
+    cpus = sorted([int(os.path.basename(p)[3:]) for p in glob.glob('/sys/devices/system/cpu/cpu[0-9]*')])
+    cores, packages, caches = {}, {}, {}
+    for cpu in cpus:
+        topology = '/sys/devices/system/cpu/cpu%d/topology/' % cpu
+        try:
+            package = int(read_file(topology + 'physical_package_id'))
+            core    = int(read_file(topology + 'core_id'))
+        except OSError:
+            # offline cpu
+            continue
+        cores.setdefault((package, core), set()).add(cpu)
+        packages.setdefault(package, set()).add(cpu)
+        for index in glob.glob('/sys/devices/system/cpu/cpu%d/cache/index*' % cpu):
+            try:
+                kind  = read_file(index + '/type')
+                level = 'L' + read_file(index + '/level') + {'Data': 'd', 'Instruction': 'i'}.get(kind, '') + 'Cache'
+                size  = read_file(index + '/size')
+                pus   = sorted(parse_cpulist(read_file(index + '/shared_cpu_list')))
+            except OSError:
+                continue
+            multiplier = {'K': 1024, 'M': 1024*1024, 'G': 1024*1024*1024}.get(size[-1], 1)
+            size = int(size.rstrip('KMG')) * multiplier
+            caches[(level, tuple(pus))] = {'level': level, 'size': size, 'pus': pus}
+    online = set().union(*packages.values()) if packages else set(cpus)
+    numa_pus, numa_memory = [], []
+    for node in sorted(glob.glob('/sys/devices/system/node/node[0-9]*')):
+        pus = parse_cpulist(read_file(node + '/cpulist')) & online
+        memory = 0
+        for line in read_file(node + '/meminfo').split('\n'):
+            if 'MemTotal' in line:
+                memory = int(line.split()[-2]) * 1024
+        numa_pus.append(pus)
+        numa_memory.append(memory)
+    total = 0
+    for line in read_file('/proc/meminfo').split('\n'):
+        if line.startswith('MemTotal'):
+            total = int(line.split()[1]) * 1024
+    if len(numa_pus)==0:
+        numa_pus, numa_memory = [online], [total]
+    if len(cores)==0:
+        cores = {(0, cpu): {cpu} for cpu in cpus}
+        packages = {0: set(cpus)}
+    return make_record(list(packages.values()), numa_pus, numa_memory, list(cores.values()),
+                       list(caches.values()), total, 'sysfs', 'sysfs')
+
+# -------------------------------------------------------------------
+# probe the node we are running on
+def probe_node():
+    lstopo = find_lstopo()
+    if lstopo is not None:
+        try:
+            return probe_hwloc(lstopo)
+        except (OSError, subprocess.CalledProcessError, ElementTree.ParseError) as exc:
+            print('lstopo failed, using sysfs :', exc)
+    return probe_sysfs()
+
+# -------------------------------------------------------------------
+# all node records in the output of one or more probe runs (e.g. an srun
+# step running the probe on every node), by hostname
+def parse_probe_records(output):
+    records = {}
+    for line in output.split('\n'):
+        # srun -l and friends may put a prefix in front of the marker
+        position = line.find(record_marker)
+        if position<0:
+            continue
+        try:
+            record = json.loads(line[position+len(record_marker):])
+        except ValueError:
+            continue
+        records[record['hostname']] = record
+    return records
+
+# -------------------------------------------------------------------
+# the node record in the output of a probe run, None if there is none
+def parse_probe_output(output):
+    records = parse_probe_records(output)
+    return next(reversed(records.values())) if len(records)!=0 else None
+
+
+if __name__ == "__main__":
+    print(record_marker + json.dumps(probe_node()), flush=True)
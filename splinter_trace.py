@@ -0,0 +1,156 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Execution trace of a splinter workflow run. For every task the time it
+# became ready, was submitted, actually started and ended are kept together
+# with the node, cores and memory it was given, so the makespan can be split
+# into scheduler overhead, launch latency, dependency waits and compute.
+# Recording is meant to stay on in production runs : each event is a
+# monotonic timestamp written into preallocated arrays, nothing is formatted
+# until the trace is exported.
+#
+# exports
+#   write_chrome(path) : Chrome trace JSON, open in Perfetto/chrome://tracing,
+#                        one process per node and one row per concurrent task
+#   write_csv(path)    : one row per task, loadable with
+#                        maestro_plotutils.read_pandas_csv (index is the task id)
+# CSV columns (times in seconds from the start of the run)
+#   name, node, cores, memory, exit_code, ready, submit, start, end,
+#   wait     : ready -> start, dependency satisfied but not yet running
+#   latency  : submit -> start, time taken by the launcher
+#   time     : start -> end, run time of the task
+#   ftime    : ready -> end, time from ready until completed
+#   futures  : tasks in flight when the task was submitted
+#   threads  : cores of the task
+#   numa     : NUMA domain of the cpus the task was bound to, -1 if unbound
+#   peak_memory : peak memory (bytes) measured when the task ran, empty if not measured
+# plus any constant columns (sweep parameters) given to write_csv
+
+import array
+import csv
+import json
+import math
+import time
+
+nan = float('nan')
+
+# -------------------------------------------------------------------
+# trace of the tasks of one run, tasks is the list known when the run
+# starts, tasks submitted later get a slot when first seen.
+# clock is the scheduler's clock when it is not the wall clock (the
+# simulator's virtual time), the times launchers report are then on it too
+class task_trace:
+
+    def __init__(self, tasks=(), clock=None):
+        tasks = list(tasks)
+        n = len(tasks)
+        self._tasks   = tasks
+        self._slots   = {task.task_id(): i for i, task in enumerate(tasks)}
+        self._ready   = array.array('d', [nan])*n
+        self._submit  = array.array('d', [nan])*n
+        self._start   = array.array('d', [nan])*n
+        self._end     = array.array('d', [nan])*n
+        self._futures = array.array('l', [0])*n
+        self._exit    = array.array('l', [0])*n
+        self._numa    = array.array('l', [-1])*n
+        self._nodes   = [None]*n
+        # times are kept relative to the start of the trace, times reported
+        # by launchers (epoch seconds) are converted with the epoch offset
+        self._clock  = clock if clock is not None else time.monotonic
+        self._origin = self._clock()
+        self._epoch  = time.time() - self._origin if clock is None else 0
+
+    def _slot(self, task):
+        slot = self._slots.get(task.task_id())
+        if slot is None:
+            slot = len(self._tasks)
+            self._slots[task.task_id()] = slot
+            self._tasks.append(task)
+            for values, fill in ((self._ready, nan), (self._submit, nan), (self._start, nan),
+                                 (self._end, nan), (self._futures, 0), (self._exit, 0), (self._numa, -1)):
+                values.append(fill)
+            self._nodes.append(None)
+        return slot
+
+    def ready(self, task):
+        self._ready[self._slot(task)] = self._clock() - self._origin
+
+    # in_flight is the number of tasks running when this one was submitted
+    def submitted(self, task, in_flight, numa=-1):
+        slot = self._slot(task)
+        self._submit[slot]  = self._clock() - self._origin
+        self._futures[slot] = in_flight
+        self._nodes[slot]   = task.node()
+        self._numa[slot]    = numa
+
+    # start/end are epoch seconds as returned by task_status.outcome()
+    def finished(self, task, exit_code, start_time, end_time):
+        slot = self._slot(task)
+        offset = self._epoch + self._origin
+        self._start[slot] = start_time - offset
+        self._end[slot]   = end_time - offset
+        self._exit[slot]  = exit_code
+
+    # -------------------------------------------------------------------
+    # one dict per finished task, in the order tasks were first seen
+    def rows(self):
+        for slot, task in enumerate(self._tasks):
+            end = self._end[slot]
+            if math.isnan(end):
+                continue
+            ready, submit, start = self._ready[slot], self._submit[slot], self._start[slot]
+            yield {'task': task.task_id(), 'name': task.name(), 'node': self._nodes[slot],
+                   'cores': task.cores(), 'memory': task.memory(), 'exit_code': self._exit[slot],
+                   'ready': ready, 'submit': submit, 'start': start, 'end': end,
+                   'wait': start - ready, 'latency': start - submit,
+                   'time': end - start, 'ftime': end - ready,
+                   'futures': self._futures[slot], 'threads': task.cores(), 'numa': self._numa[slot],
+                   'peak_memory': task.peak_memory()}
+
+    # -------------------------------------------------------------------
+    # tags are constant columns added to every row, e.g. sweep parameters
+    def write_csv(self, path, tags=None):
+        tags = tags if tags is not None else {}
+        rows = self.rows()
+        with open(path, 'w', newline='') as f:
+            writer = None
+            for row in rows:
+                row.update(tags)
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row.keys()))
+                    writer.writeheader()
+                writer.writerow(row)
+        print('Trace written to', path)
+
+    # -------------------------------------------------------------------
+    # each node is a process, tasks on a node are spread over rows (threads)
+    # so that tasks running at the same time never share a row
+    def write_chrome(self, path):
+        rows = sorted(self.rows(), key=lambda row: row['start'])
+        pids  = {}
+        lanes = {}
+        events = []
+        for row in rows:
+            node = row['node']
+            if node not in pids:
+                pids[node] = len(pids) + 1
+                lanes[node] = []
+                events.append({'name': 'process_name', 'ph': 'M', 'pid': pids[node],
+                               'args': {'name': str(node)}})
+            # first row free at the start of this task
+            ends = lanes[node]
+            lane = next((i for i, busy in enumerate(ends) if busy<=row['start']), len(ends))
+            if lane==len(ends):
+                ends.append(row['end'])
+            else:
+                ends[lane] = row['end']
+            events.append({'name': str(row['name']), 'cat': 'task', 'ph': 'X',
+                           'ts': row['start']*1e6, 'dur': row['time']*1e6,
+                           'pid': pids[node], 'tid': lane,
+                           'args': {'task': str(row['task']), 'cores': row['cores'],
+                                    'memory': row['memory'], 'peak_memory': row['peak_memory'],
+                                    'exit_code': row['exit_code'],
+                                    'wait': row['wait'], 'latency': row['latency']}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print('Trace written to', path)
@@ -0,0 +1,116 @@
+# #!/usr/bin/env python3
+
+# -------------------------------------------------------------------
+# Regression tests of the splinter scheduler, tasks run locally on a pool
+# of one node, run with : python -m pytest tests (or python -m unittest)
+
+import contextlib
+import io
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import splinter
+
+# -------------------------------------------------------------------
+# a workflow on a local pool with room for all the tasks at once
+def local_workflow(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return splinter.splinter_workflow(pool=splinter.node_pool(nodes={'localhost': (8, 2**33)}, cpu_binding=False),
+                                          memory_interval=0, **kwargs)
+
+def add_tasks(workflow, tasks):
+    with contextlib.redirect_stdout(io.StringIO()):
+        for task_id, command, parents in tasks:
+            workflow.add_task(splinter.task(task_id, command, parents, 1, 2**20))
+
+def ids(tasks):
+    return sorted([task.task_id() for task in tasks])
+
+class abort_and_cancel_tests(unittest.TestCase):
+
+    # a task still running when the workflow aborts may complete successfully,
+    # its children must not be released (they were cancelled by the abort)
+    def test_abort_with_running_task(self):
+        workflow = local_workflow(failure_policy='abort')
+        add_tasks(workflow, [('a', ['false'], []),
+                             ('b', ['sleep', '1'], []),
+                             ('d', ['sleep', '2'], []),
+                             ('c', ['true'], ['b'])])
+        with contextlib.redirect_stdout(io.StringIO()):
+            ok = workflow.execute_workflow(0, False, log_dir=os.devnull)
+        self.assertFalse(ok)
+        self.assertEqual(ids(workflow.failed_tasks()), ['a'])
+        self.assertEqual(ids(workflow.cancelled_tasks()), ['c'])
+        # running tasks were left to finish, not killed
+        self.assertEqual(ids(workflow._completed_task_array), ['b', 'd'])
+
+    # cancel() of a running workflow, a task that still ends successfully
+    # (here it ignores the kill) must not release its children either, e
+    # keeps the workflow running once b has completed
+    def test_cancel_with_completing_task(self):
+        workflow = local_workflow()
+        add_tasks(workflow, [('b', ['sh', '-c', 'trap "" TERM; sleep 1'], []),
+                             ('e', ['sh', '-c', 'trap "" TERM; sleep 2'], []),
+                             ('d', ['sleep', '30'], []),
+                             ('c', ['true'], ['b'])])
+        with contextlib.redirect_stdout(io.StringIO()):
+            run = workflow.start_workflow(0, False, log_dir=os.devnull)
+            time.sleep(0.3)
+            run.cancel()
+            ok = run.result(timeout=30)
+        self.assertFalse(ok)
+        self.assertEqual(ids(workflow.cancelled_tasks()), ['c', 'd'])
+        self.assertEqual(ids(workflow._completed_task_array), ['b', 'e'])
+        self.assertEqual(workflow.failed_tasks(), [])
+
+    # cancel() once the run is over is ignored, the next run still runs
+    # every task, and posts no events to the handle of the earlier run
+    def test_cancel_after_run(self):
+        workflow = local_workflow()
+        add_tasks(workflow, [('a', ['true'], [])])
+        with contextlib.redirect_stdout(io.StringIO()):
+            run = workflow.start_workflow(0, False, log_dir=os.devnull)
+            self.assertTrue(run.result(timeout=30))
+            run.cancel()
+            events = run.poll_events()
+            ok = workflow.execute_workflow(0, False, log_dir=os.devnull)
+        self.assertTrue(ok)
+        self.assertEqual(workflow.cancelled_tasks(), [])
+        self.assertEqual([event['task'].task_id() for event in events], ['a'])
+        self.assertEqual(run.poll_events(), [])
+
+    # the counts of a second run of the same workflow are those of that run
+    def test_progress_of_second_run(self):
+        workflow = local_workflow()
+        add_tasks(workflow, [('a', ['true'], []), ('b', ['true'], ['a'])])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(workflow.execute_workflow(0, False, log_dir=os.devnull))
+            self.assertTrue(workflow.execute_workflow(0, False, log_dir=os.devnull))
+        self.assertEqual(ids(workflow._completed_task_array), ['a', 'b'])
+        self.assertEqual(workflow.progress()['completed'], 2)
+        self.assertEqual(workflow.progress()['total'], 2)
+
+    # a task submitted once its parent has failed is cancelled like the other
+    # descendants of the parent, with an event and its callback
+    def test_submit_after_parent_failed(self):
+        workflow = local_workflow()
+        cancelled = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            with workflow.submitting():
+                run = workflow.start_workflow(0, False, log_dir=os.devnull)
+                parent = workflow.submit(['false'], task_id='a')
+                while workflow.progress()['failed']==0:
+                    time.sleep(0.05)
+                workflow.submit(['true'], deps=[parent], task_id='b',
+                                callback=lambda task, exit_code: cancelled.append((task.task_id(), exit_code)))
+            self.assertFalse(run.result(timeout=30))
+        events = [(event['task'].task_id(), event['state']) for event in run.events()]
+        self.assertEqual(events, [('a', 'failed'), ('b', 'cancelled')])
+        self.assertEqual(cancelled, [('b', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()